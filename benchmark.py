@@ -0,0 +1,365 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks klm.py, the CalculatorLogger and the log analysis of the notebooks on generated workloads.
+
+The workloads are generated with a fixed seed, so every run measures the same input:
+    - klm scripts from 1 KB to 100 MB in the style of klm_example.txt (comments, lower and upper case, large repeat
+      counts) for parse_klm_file()
+    - operator strings with millions of operators for calculate_completion_time()
+    - 1k to 1M events for CalculatorLogger.add_new_log_data() with the background writer
+    - the operator logs and participant logs in the repo repeated up to 1M rows for the analysis of calculator_klm.ipynb
+      (klm_timing.extract_klm_values()) and klm_report.ipynb (klm_experiment.segment_tasks()), read from csv and from
+      the binary format
+
+Every benchmark is run several times, the median and the minimum of the wall clock times are reported. The results are
+written as json; with --compare they are checked against a saved baseline and the script exits with 1 if a benchmark
+got slower by more than the allowed regression (a fraction of the baseline median, default 0.25, can be set per
+benchmark with --threshold).
+
+Usage:
+    python benchmark.py -o benchmark_baseline.json
+    python benchmark.py --quick --compare benchmark_baseline.json --max-regression 0.5 --threshold parse_klm_file=1.0
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import datetime
+import tempfile
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+
+BENCHMARK_FILE_VERSION = 1
+DEFAULT_MAX_REGRESSION = 0.25
+DEFAULT_SEED = 21
+
+KLM_SCRIPT_SIZES = {"1KB": 1 << 10, "1MB": 1 << 20, "100MB": 100 << 20}
+QUICK_KLM_SCRIPT_SIZES = {"1KB": 1 << 10, "100KB": 100 << 10, "1MB": 1 << 20}
+OPERATOR_COUNTS = {"1M": 1_000_000, "10M": 10_000_000}
+QUICK_OPERATOR_COUNTS = {"100k": 100_000, "1M": 1_000_000}
+LOG_EVENT_COUNTS = {"1k": 1_000, "100k": 100_000, "1M": 1_000_000}
+QUICK_LOG_EVENT_COUNTS = {"1k": 1_000, "10k": 10_000}
+ANALYSIS_ROW_COUNTS = {"10k": 10_000, "1M": 1_000_000}
+QUICK_ANALYSIS_ROW_COUNTS = {"10k": 10_000}
+
+_OPERATOR_LOG_FILES = {"K": "klm_k_log.csv", "P": "klm_p_log.csv", "B": "klm_b_log.csv", "H": "klm_h_log.csv"}
+_PARTICIPANT_LOG_FILE = "calculator_experiment_p_0.csv"
+_REPOSITORY_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+class Benchmark:
+    """
+    A single measurement: run(state) is timed, setup() prepares a fresh state for every repetition without being
+    timed. items is the size of the workload (bytes, operators, events or rows) for the throughput.
+    """
+    __slots__ = ("name", "items", "unit", "run", "setup")
+
+    def __init__(self, name: str, items: int, unit: str, run, setup=None):
+        self.name = name
+        self.items = items
+        self.unit = unit
+        self.run = run
+        self.setup = setup
+
+
+def generate_klm_script(file_name: str, size: int, rng: np.random.Generator, block_size: int = 1 << 20) -> None:
+    """
+    Writes a klm script with about the given size in bytes: lines with a few operators, repeat counts (some of them
+    large), mixed case and comments like in klm_example.txt. Scripts larger than block_size repeat a generated block
+    of that size, which keeps generating 100 MB fast.
+    """
+    comments = np.array(["", "", " # remember username, enter eight keystrokes", " # switch to mouse and click",
+                         " # tab, switches to password field"])
+    comment_line = "# " + "a comment line that only explains the next steps " * 2
+    line_count = min(size, block_size) // 16 + 1
+    operator_lengths = rng.integers(1, 6, size=line_count)
+    operators = rng.choice(list("KPHBMkphbm"), size=int(operator_lengths.sum()))
+    operator_offsets = np.concatenate(([0], np.cumsum(operator_lengths)))
+    counts = rng.choice(["", "", "", "8", "13", "120", "100000"], size=line_count)
+    line_comments = comments[rng.integers(len(comments), size=line_count)]
+    is_comment_line = rng.random(line_count) < 0.05
+
+    lines = []
+    written = 0
+    for line_number in range(line_count):
+        if is_comment_line[line_number]:
+            line = comment_line
+        else:
+            line_operators = "".join(operators[operator_offsets[line_number]:operator_offsets[line_number + 1]])
+            line = f"{counts[line_number]}{line_operators}{line_comments[line_number]}"
+        lines.append(line + "\n")
+        written += len(line) + 1
+        if written >= min(size, block_size):
+            break
+    block = "".join(lines)
+    with open(file_name, "w") as klm_file:
+        for _ in range(size // len(block)):
+            klm_file.write(block)
+        remainder = block[:size % len(block)].rpartition("\n")[0]
+        if remainder:
+            klm_file.write(remainder + "\n")
+
+
+def generate_operators(count: int, rng: np.random.Generator) -> str:
+    return "".join(rng.choice(list("KPHBM"), size=count))
+
+
+def tile_log(log: pd.DataFrame, rows: int) -> pd.DataFrame:
+    """
+    Repeats a log until it has the given number of rows; the timestamps of every copy continue after the previous one,
+    so the repeated log looks like one long session.
+    """
+    copies = -(-rows // len(log))
+    time_stamps = log["timeStamp"].to_numpy(dtype=np.float64)
+    span = time_stamps[-1] - time_stamps[0] + 1.0
+    tiled = pd.concat([log] * copies, ignore_index=True).iloc[:rows].copy()
+    copy_numbers = np.repeat(np.arange(copies), len(log))[:rows]
+    tiled["timeStamp"] = np.tile(time_stamps, copies)[:rows] + copy_numbers * span
+    if "timeStampNs" in log.columns:
+        tiled["timeStampNs"] = (np.tile(log["timeStampNs"].to_numpy(dtype=np.int64), copies)[:rows] +
+                                copy_numbers * int(span * 1e9))
+    return tiled
+
+
+def _parse_klm_benchmarks(workload_directory: str, sizes: dict[str, int], rng: np.random.Generator) -> list:
+    from klm import parse_klm_file
+
+    def run(file_name):
+        # parse_klm_file() prints the operators, which is part of its cost
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            parse_klm_file(file_name)
+
+    benchmarks = []
+    for label, size in sizes.items():
+        file_name = os.path.join(workload_directory, f"klm_script_{label}.txt")
+        if not os.path.isfile(file_name):
+            generate_klm_script(file_name, size, rng)
+        benchmarks.append(Benchmark(f"parse_klm_file[{label}]", os.path.getsize(file_name), "bytes",
+                                    lambda state, file_name=file_name: run(file_name)))
+    return benchmarks
+
+
+def _completion_time_benchmarks(counts: dict[str, int], rng: np.random.Generator) -> list:
+    from klm import KLM_CUSTOM_VALUES, calculate_completion_time
+
+    benchmarks = []
+    for label, count in counts.items():
+        operators = generate_operators(count, rng)
+        benchmarks.append(Benchmark(f"calculate_completion_time[{label}]", count, "operators",
+                                    lambda state, operators=operators: calculate_completion_time(operators,
+                                                                                                 KLM_CUSTOM_VALUES)))
+    return benchmarks
+
+
+def _logger_benchmarks(workload_directory: str, counts: dict[str, int]) -> list:
+    from calculator_logger import CalculatorLogger
+
+    log_file_name = os.path.join(workload_directory, "logger_benchmark.csv")
+
+    def setup():
+        for file_name in (log_file_name, f"{log_file_name}.idx"):
+            if os.path.exists(file_name):
+                os.remove(file_name)
+        return CalculatorLogger(log_file_name, background_writing=True)
+
+    def run(logger, count):
+        add_new_log_data = logger.add_new_log_data
+        for event in range(count):
+            add_new_log_data(None, "keyStroke", False, "K", "1234567890"[event % 10])
+        # includes writing the remaining rows, otherwise only the queueing would be measured
+        logger.close()
+
+    return [Benchmark(f"add_new_log_data[{label}]", count, "events",
+                      lambda logger, count=count: run(logger, count), setup)
+            for label, count in counts.items()]
+
+
+def _analysis_benchmarks(workload_directory: str, row_counts: dict[str, int]) -> list:
+    from calculator_log_format import read_log, csv_to_binary
+    from klm_timing import extract_klm_values
+    from klm_experiment import segment_tasks
+
+    benchmarks = []
+    for label, rows in row_counts.items():
+        # calculator_klm.ipynb: read the four operator logs and extract the klm values
+        operator_logs = {}
+        for operator, log_file in _OPERATOR_LOG_FILES.items():
+            file_name = os.path.join(workload_directory, f"klm_{operator.lower()}_log_{label}.csv")
+            if not os.path.isfile(file_name):
+                tile_log(read_log(os.path.join(_REPOSITORY_DIRECTORY, log_file)), rows).to_csv(file_name, index=False)
+            operator_logs[operator] = file_name
+        benchmarks.append(Benchmark(
+            f"extract_klm_values[{label}]", 4 * rows, "rows",
+            lambda state, logs=operator_logs: extract_klm_values(*(read_log(logs[operator]) for operator in "KPBH"))))
+
+        # klm_report.ipynb: read a participant log and segment it into tasks, from csv and from the binary format
+        csv_file = os.path.join(workload_directory, f"participant_log_{label}.csv")
+        binary_file = os.path.join(workload_directory, f"participant_log_{label}.calclog")
+        if not os.path.isfile(csv_file):
+            tile_log(read_log(os.path.join(_REPOSITORY_DIRECTORY, _PARTICIPANT_LOG_FILE)), rows).to_csv(csv_file,
+                                                                                                      index=False)
+        if not os.path.isfile(binary_file):
+            csv_to_binary(csv_file, binary_file)
+        for log_format, file_name in (("csv", csv_file), ("binary", binary_file)):
+            benchmarks.append(Benchmark(f"segment_tasks[{label},{log_format}]", rows, "rows",
+                                        lambda state, file_name=file_name: segment_tasks(read_log(file_name))))
+    return benchmarks
+
+
+def collect_benchmarks(workload_directory: str, quick: bool = False, seed: int = DEFAULT_SEED) -> list[Benchmark]:
+    """
+    Generates the workloads (files that already exist in the workload directory are reused) and returns all
+    benchmarks. quick uses smaller workloads, e.g. for a check before every commit.
+    """
+    rng = np.random.default_rng(seed)
+    return (_parse_klm_benchmarks(workload_directory, QUICK_KLM_SCRIPT_SIZES if quick else KLM_SCRIPT_SIZES, rng) +
+            _completion_time_benchmarks(QUICK_OPERATOR_COUNTS if quick else OPERATOR_COUNTS, rng) +
+            _logger_benchmarks(workload_directory, QUICK_LOG_EVENT_COUNTS if quick else LOG_EVENT_COUNTS) +
+            _analysis_benchmarks(workload_directory, QUICK_ANALYSIS_ROW_COUNTS if quick else ANALYSIS_ROW_COUNTS))
+
+
+def measure(benchmark: Benchmark, repeat: int) -> dict:
+    """
+    Runs the benchmark repeat times (after one untimed warm-up run) and returns its timings in seconds.
+    """
+    times = []
+    for repetition in range(repeat + 1):
+        state = benchmark.setup() if benchmark.setup is not None else None
+        start = time.perf_counter_ns()
+        benchmark.run(state)
+        if repetition > 0:
+            times.append((time.perf_counter_ns() - start) / 1e9)
+    median = float(np.median(times))
+    return {
+        "items": benchmark.items,
+        "unit": benchmark.unit,
+        "repeat": repeat,
+        "median_s": median,
+        "min_s": min(times),
+        "max_s": max(times),
+        "items_per_s": benchmark.items / median if median > 0 else None,
+    }
+
+
+def run_benchmarks(benchmarks: list[Benchmark], repeat: int = 3, name_filter: str = None) -> dict:
+    results = {}
+    for benchmark in benchmarks:
+        if name_filter and name_filter not in benchmark.name:
+            continue
+        results[benchmark.name] = measure(benchmark, repeat)
+        result = results[benchmark.name]
+        sys.stderr.write(f"{benchmark.name}: {result['median_s']:.4f} s (min {result['min_s']:.4f} s, "
+                         f"{result['items_per_s']:.4g} {benchmark.unit}/s)\n")
+    return {
+        "version": BENCHMARK_FILE_VERSION,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "benchmarks": results,
+    }
+
+
+def compare_results(results: dict, baseline: dict, max_regression: float = DEFAULT_MAX_REGRESSION,
+                    thresholds: dict[str, float] = None) -> list[dict]:
+    """
+    Compares the median times with a baseline. A threshold applies to all benchmarks whose name starts with its key
+    (e.g. "parse_klm_file" for all script sizes), the longest matching key wins.
+
+    :return: one row per benchmark that is in both results with the ratio of the medians and whether it regressed
+    """
+    if baseline.get("version") != BENCHMARK_FILE_VERSION:
+        raise ValueError(f"The baseline has the version {baseline.get('version')}, expected {BENCHMARK_FILE_VERSION}!")
+    thresholds = thresholds or {}
+    comparison = []
+    for name, result in results["benchmarks"].items():
+        baseline_result = baseline["benchmarks"].get(name)
+        if baseline_result is None:
+            continue
+        matching_keys = [key for key in thresholds if name.startswith(key)]
+        allowed = thresholds[max(matching_keys, key=len)] if matching_keys else max_regression
+        ratio = result["median_s"] / baseline_result["median_s"] if baseline_result["median_s"] > 0 else 1.0
+        comparison.append({"name": name, "baseline_s": baseline_result["median_s"], "median_s": result["median_s"],
+                           "ratio": ratio, "allowed_regression": allowed, "regressed": ratio > 1 + allowed})
+    return comparison
+
+
+def _parse_thresholds(values: list[str]) -> dict[str, float]:
+    thresholds = {}
+    for value in values:
+        name, separator, threshold = value.rpartition("=")
+        if not separator or not name:
+            raise ValueError(f"invalid threshold {value} (expected name=fraction)")
+        thresholds[name] = float(threshold)
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks klm.py, the CalculatorLogger and the log analysis on "
+                                                 "generated workloads.")
+    parser.add_argument("-o", "--output", help="write the results as json to this file (default: stdout)", type=str,
+                        default=None)
+    parser.add_argument("--quick", help="use smaller workloads", action="store_true")
+    parser.add_argument("-r", "--repeat", help="number of timed runs per benchmark (default: 3)", type=int, default=3)
+    parser.add_argument("-k", "--filter", help="only run the benchmarks whose name contains this string", type=str,
+                        default=None)
+    parser.add_argument("--workload-dir", help="keep the generated workloads in this directory and reuse them in the "
+                                               "next run (default: a temporary directory)", type=str, default=None)
+    parser.add_argument("--seed", help=f"seed for the generated workloads (default: {DEFAULT_SEED})", type=int,
+                        default=DEFAULT_SEED)
+    parser.add_argument("--compare", help="compare the results with this baseline file and fail on regressions",
+                        type=str, default=None)
+    parser.add_argument("--max-regression", help=f"allowed slowdown as a fraction of the baseline median (default: "
+                                                 f"{DEFAULT_MAX_REGRESSION})", type=float,
+                        default=DEFAULT_MAX_REGRESSION)
+    parser.add_argument("--threshold", help="allowed slowdown for the benchmarks starting with a name, e.g. "
+                                            "add_new_log_data=0.5 (can be repeated)", type=str, action="append",
+                        default=[])
+    args = parser.parse_args()
+
+    try:
+        thresholds = _parse_thresholds(args.threshold)
+    except ValueError as error:
+        parser.error(str(error))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    workload_directory = args.workload_dir or tempfile.mkdtemp(prefix="calculator_benchmark_")
+    os.makedirs(workload_directory, exist_ok=True)
+    try:
+        results = run_benchmarks(collect_benchmarks(workload_directory, args.quick, args.seed), args.repeat,
+                                 args.filter)
+    finally:
+        if not args.workload_dir:
+            shutil.rmtree(workload_directory, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(text + "\n")
+    elif baseline is None:
+        print(text)
+
+    if baseline is not None:
+        comparison = compare_results(results, baseline, args.max_regression, thresholds)
+        for row in comparison:
+            print(f"{'REGRESSION' if row['regressed'] else 'ok':<10} {row['name']}: {row['baseline_s']:.4f} s -> "
+                  f"{row['median_s']:.4f} s ({row['ratio'] - 1:+.1%}, allowed {row['allowed_regression']:+.0%})")
+        if any(row["regressed"] for row in comparison):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
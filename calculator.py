@@ -4,50 +4,24 @@ This script was written by Johannes Lorper
 
 import sys
 import os
-import time
-from PyQt5 import QtWidgets, QtCore, uic
-import pandas as pd
-
-
-class CalculatorLogger:
-
-    def __init__(self, logfile):
-        self.__log_file_name = logfile
-        self.__calculator_data = self.__init_study_data()
-
-    def __init_study_data(self):
-        # check if the file already exists
-        if os.path.isfile(self.__log_file_name):
-            calculator_data = pd.read_csv(self.__log_file_name)
-        else:
-            calculator_data = pd.DataFrame(
-                columns=['timeStamp', 'eventType', 'isMouse', 'klmId', 'button'])
-        return calculator_data
-
-    def add_new_log_data(self, time_stamp, event_type, is_mouse, klm_id, button):
-        log_data = {'timeStamp': time_stamp, 'eventType': event_type, 'isMouse': is_mouse, 'klmId': klm_id,
-                    'button': button}
-        print(log_data)
-        self.__calculator_data = self.__calculator_data.append(log_data, ignore_index=True)
-        self.__calculator_data.to_csv(self.__log_file_name, index=False)
-        with open(self.__log_file_name) as file:
-            print(file.readlines()[-1])
-
-
-# decorator for logging all inputs
-def input_logging_decorator(function):
-    def wrapper(*args, **kwargs):
-        print('New input via {}: {}'.format(function.__name__, args[1]))
-        return function(*args, **kwargs)
-
-    return wrapper
+import argparse
+from PyQt5 import QtWidgets, QtCore
+from calculator_logger import CalculatorLogger, LOG_SINK_ENV_VARIABLE
+from calculator_evaluator import IncrementalEvaluator
+from mouse_trajectory import TrajectoryBuffer
+from ui_loader import load_ui, FirstFrameTimer, process_start_time
+import instrumentation
+from instrumentation import instrument
 
 
 class IttCalculator(QtWidgets.QWidget):
-    def __init__(self, logfile="calculatorLog.csv"):
+    # if a trajectory_sample_rate (samples per second) is given, all mouse movements are recorded as well; the log is
+    # streamed to the collector at log_sink (default: the address in CALCULATOR_LOG_SINK, if it is set)
+    def __init__(self, logfile="calculatorLog.csv", trajectory_sample_rate=None, log_sink=None):
         super().__init__()
-        self.__ui = uic.loadUi("calculator.ui", self)
+        self.__ui = load_ui("calculator.ui", self)
         self.__equation_text = ""
+        self.__equation_evaluator = IncrementalEvaluator()
         self.__equation_label = self.__ui.EquationLabel
         self.__result_text = ""
         self.__result_label = self.__ui.ResultLabel
@@ -55,13 +29,20 @@ class IttCalculator(QtWidgets.QWidget):
         self.__allowed_operators = ["/", "*", "+", "-", "(", ")"]
         self._setup_keys()
         self._logfile_name = logfile
-        self._calculatorLogger = CalculatorLogger(logfile)
+        self._calculatorLogger = CalculatorLogger(logfile, background_writing=True,
+                                                  log_sink=log_sink or os.environ.get(LOG_SINK_ENV_VARIABLE),
+                                                  argument_column='button')
         self._mouse_move_path = []
+        self._trajectory_buffer = None
+        self._event_time_ns = None
+        if trajectory_sample_rate:
+            self.__setup_trajectory_capture(trajectory_sample_rate)
         self.show()
 
     # add a new input to our equation and equation-label
     def __add_to_equation(self, new_input):
         self.__equation_text += new_input
+        self.__equation_evaluator.add(new_input)
         self.__equation_label.setText(self.__equation_text)
 
     # execute an input command
@@ -71,49 +52,59 @@ class IttCalculator(QtWidgets.QWidget):
             self.__result_label.setText(self.__result_text)
         elif command == "Clear":
             self.__equation_text = ""
+            self.__equation_evaluator.clear()
             self.__equation_label.setText(self.__equation_text)
         elif command == "DEL":
             self.__equation_text = self.__equation_text[:-1]
+            self.__equation_evaluator.delete_last()
             self.__equation_label.setText(self.__equation_text)
 
-    # calculates and returns the result of the equation by using the eval() function,
+    # returns the result of the equation from the incremental evaluator (no need to parse the whole equation again),
     # returns "Err" string if the equation cant be solved
     def __calculate_result(self):
+        return self.__equation_evaluator.result()
 
-        try:
-            result = str(eval(self.__equation_text))
-            return result
-        except Exception:
-            return "Err"
+    # returns the current value of the (possibly unfinished) equation or None if there is none yet
+    def get_preview_result(self):
+        return self.__equation_evaluator.preview()
 
-    # sends a new keyboard "command" input (enter, clear or backspace) to the log (through the decorator)
+    # sends a new keyboard "command" input (enter, clear or backspace) to the log
     # and to the executes_command() function
-    @input_logging_decorator
+    @instrument
     def __keyboard_input_command(self, new_input):
-        self._calculatorLogger.add_new_log_data(time.time(), "keyStroke", False, 'k', new_input)
+        self._calculatorLogger.add_new_log_data(self._take_event_time_ns(), "keyStroke", False, 'k', new_input)
         self.__execute_command(new_input)
 
-    # sends a new mouse "command" input (enter, clear or backspace) to the log (through the decorator)
+    # sends a new mouse "command" input (enter, clear or backspace) to the log
     # and to the execute_command() function
-    @input_logging_decorator
+    @instrument
     def __mouse_input_command(self, button):
-        self._calculatorLogger.add_new_log_data(time.time(), "mouseClick", True, 'B', button)
+        self._flush_mouse_movement()
+        self._calculatorLogger.add_new_log_data(self._take_event_time_ns(), "mouseClick", True, 'B', button)
         self.__execute_command(button)
 
-    # sends a new keyboard "number or operator" input to the log (through the decorator)
+    # sends a new keyboard "number or operator" input to the log
     # and to the add_to_equation() function
-    @input_logging_decorator
+    @instrument
     def __keyboard_input_number_or_operator(self, new_input):
-        self._calculatorLogger.add_new_log_data(time.time(), "keyStroke", False, 'k', new_input)
+        self._calculatorLogger.add_new_log_data(self._take_event_time_ns(), "keyStroke", False, 'k', new_input)
         self.__add_to_equation(new_input)
 
-    # sends a new mouse "number or operator" input to the log (through the decorator)
+    # sends a new mouse "number or operator" input to the log
     # and to the add_to_equation() function
-    @input_logging_decorator
+    @instrument
     def __mouse_input_number_or_operator(self, button):
-        self._calculatorLogger.add_new_log_data(time.time(), "mouseClick", True, 'B', button)
+        self._flush_mouse_movement()
+        self._calculatorLogger.add_new_log_data(self._take_event_time_ns(), "mouseClick", True, 'B', button)
         self.__add_to_equation(button)
 
+    # returns the time of the input event that is handled right now (set in eventFilter / keyPressEvent) or None if
+    # there is none, so the logger uses the current time
+    def _take_event_time_ns(self):
+        event_time_ns = self._event_time_ns
+        self._event_time_ns = None
+        return event_time_ns
+
     def _setup_keys(self) -> None:
         self.__DIGIT_KEYS = [self.__ui.NumButton_0, self.__ui.NumButton_1,
                              self.__ui.NumButton_2, self.__ui.NumButton_3,
@@ -126,6 +117,11 @@ class IttCalculator(QtWidgets.QWidget):
                                 self.__ui.NumButton_DecPoint, self.__ui.BracketButton_Open,
                                 self.__ui.BracketButton_Close]
 
+        self.__COMMAND_KEYS = [self.__ui.NumButton_Enter, self.__ui.NumButton_Clear, self.__ui.NumButton_Delete]
+
+        # the buttons whose hover events are logged (with the trajectory capture, all widgets have the event filter)
+        self.__CALCULATOR_BUTTONS = set(self.__DIGIT_KEYS + self.__OPERATOR_KEYS + self.__COMMAND_KEYS)
+
         # don't let user edit input field directly for now
         self._setup_listeners()
 
@@ -145,16 +141,57 @@ class IttCalculator(QtWidgets.QWidget):
         self.__ui.NumButton_Delete.clicked.connect(lambda: self.__mouse_input_command("DEL"))
         self.__ui.NumButton_Delete.installEventFilter(self)
 
+    # enables mouse tracking on all widgets so every mouse movement reaches the event filter
+    def __setup_trajectory_capture(self, sample_rate):
+        self._trajectory_buffer = TrajectoryBuffer(sample_rate=sample_rate)
+        self.setMouseTracking(True)
+        self.installEventFilter(self)
+        for widget in self.findChildren(QtWidgets.QWidget):
+            widget.setMouseTracking(True)
+            widget.installEventFilter(self)
+
+    # writes the recorded mouse trajectory to the log in one batch (called on every click, so it happens between
+    # the pointing movements) and starts a new mouse path
+    def _flush_mouse_movement(self):
+        self._mouse_move_path = []
+        if self._trajectory_buffer is not None:
+            self._calculatorLogger.add_trajectory_samples(self._trajectory_buffer.drain())
+
     # EventFilter to log mouse movement over buttons
+    # (all events are stamped with the time Qt received them, not with the time they are handled here)
+    @instrument
     def eventFilter(self, source, event):
-        if event.type() == QtCore.QEvent.HoverEnter:
-            if self._mouse_move_path[-1:] != source:
+        if event.type() == QtCore.QEvent.MouseMove:
+            if self._trajectory_buffer is not None:
+                # only store the sample here, it is written to the log with the next click
+                position = event.windowPos()
+                self._trajectory_buffer.add(self._calculatorLogger.clock.event_time_ns(event.timestamp()),
+                                            int(position.x()), int(position.y()))
+        elif source not in self.__CALCULATOR_BUTTONS:
+            pass  # only the mouse movements over the other widgets are recorded
+        elif event.type() == QtCore.QEvent.HoverEnter:
+            if self._mouse_move_path[-1:] != [source]:
+                self._mouse_move_path.append(source)
                 # We use "Px" here because its not the whole pointing even "P", but just a part of it
-                self._calculatorLogger.add_new_log_data(time.time(), "mouseMove", True, "Px", source.text())
+                self._calculatorLogger.add_new_log_data(self._calculatorLogger.clock.event_time_ns(event.timestamp()),
+                                                        "mouseMove", True, "Px", source.text())
+        elif event.type() == QtCore.QEvent.MouseButtonPress:
+            self._event_time_ns = None
+        elif event.type() == QtCore.QEvent.MouseButtonRelease:
+            # the clicked signal of the button is emitted right after this, its handler logs the click with this time
+            self._event_time_ns = self._calculatorLogger.clock.event_time_ns(event.timestamp())
         return False
 
+    # flush the log to the disk when the window is closed
+    def closeEvent(self, event):
+        self._flush_mouse_movement()
+        self._calculatorLogger.close()
+        super().closeEvent(event)
+
     # registers all relevant key press events
+    @instrument
     def keyPressEvent(self, event):
+        self._event_time_ns = self._calculatorLogger.clock.event_time_ns(event.timestamp())
         if event.text() in self.__allowed_numbers:
             self.__keyboard_input_number_or_operator(event.text())
         elif event.text() in self.__allowed_operators:
@@ -168,10 +205,16 @@ class IttCalculator(QtWidgets.QWidget):
 
 
 if __name__ == '__main__':
-    app = QtWidgets.QApplication(sys.argv)
-    if len(sys.argv) > 1:
-        logfile_name = sys.argv[1]
-        calculator = IttCalculator(logfile_name)
-    else:
-        calculator = IttCalculator()
+    # handler durations are only measured if CALCULATOR_INSTRUMENTATION is set (see instrumentation.py)
+    instrumentation.setup_from_environment()
+    parser = argparse.ArgumentParser(description="The calculator used to evaluate the KLM predictions.")
+    parser.add_argument("logfile", help="the csv file the events are logged to (default: calculatorLog.csv)",
+                        nargs="?", default="calculatorLog.csv")
+    parser.add_argument("--trajectory-rate", help="also record the mouse movements with at most this many samples "
+                                                  "per second (default: off)", type=float, default=None)
+    args, qt_arguments = parser.parse_known_args()
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_arguments)
+    calculator = IttCalculator(args.logfile, trajectory_sample_rate=args.trajectory_rate)
+    # prints the startup time of the calculator (including the python startup and all imports)
+    first_frame_timer = FirstFrameTimer(calculator, process_start_time())
     sys.exit(app.exec_())
@@ -0,0 +1,209 @@
+"""
+An incremental evaluator for the calculator equations that replaces the eval() call in the IttCalculator classes.
+
+Grammar (the same as python uses for these characters):
+    expression := term (("+" | "-") term)*
+    term       := factor (("*" | "/") factor)*
+    factor     := ("+" | "-") factor | number | "(" expression ")"
+    number     := digits with at most one "." (e.g. "3", "15.2", ".5", "5.")
+
+Instead of parsing the whole equation again on every "=", the parser state is updated for every typed character. Each
+state is immutable, so deleting the last character only has to restore the previous state from a history stack.
+"""
+
+
+class _Frame:
+    """
+    The parser state of one parenthesis level (immutable).
+
+    sum_value / add_operator: the value of the finished terms and the operator before the current term
+    term_value / mul_operator: the value of the finished factors of the current term and the operator before the
+                               current factor
+    negate: whether the current factor has an odd number of unary minus signs
+    number: the digits of the number that is currently typed (or None)
+    factor: the value of a closed parenthesis that is the current factor (or None)
+    parent: the frame of the enclosing parenthesis level (None for the outermost level)
+    """
+    __slots__ = ("sum_value", "add_operator", "term_value", "mul_operator", "negate", "number", "factor", "parent",
+                 "depth")
+
+    def __init__(self, sum_value=None, add_operator=None, term_value=None, mul_operator=None, negate=False,
+                 number=None, factor=None, parent=None):
+        self.sum_value = sum_value
+        self.add_operator = add_operator
+        self.term_value = term_value
+        self.mul_operator = mul_operator
+        self.negate = negate
+        self.number = number
+        self.factor = factor
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+
+    def replace(self, **changes) -> "_Frame":
+        values = {name: getattr(self, name) for name in self.__slots__ if name != "depth"}
+        values.update(changes)
+        return _Frame(**values)
+
+    def has_operand(self) -> bool:
+        return self.number is not None or self.factor is not None
+
+    def operand_value(self):
+        value = self.factor if self.factor is not None else _to_number(self.number)
+        return -value if self.negate else value
+
+    def finish_term(self):
+        """
+        Returns the value of the current term including the current operand.
+        """
+        operand = self.operand_value()
+        if self.term_value is None:
+            return operand
+        return self.term_value * operand if self.mul_operator == "*" else self.term_value / operand
+
+    def finish(self):
+        """
+        Returns the value of the whole expression on this level.
+        """
+        term_value = self.finish_term()
+        if self.sum_value is None:
+            return term_value
+        return self.sum_value + term_value if self.add_operator == "+" else self.sum_value - term_value
+
+
+def _to_number(text: str):
+    if "." in text:
+        return float(text)
+    # like in python, integers can't have leading zeros ("00" is 0, but "01" is invalid while "01.5" is a float)
+    if text[0] == "0" and text.strip("0"):
+        raise _InvalidEquation()
+    try:
+        return int(text)
+    except ValueError:
+        raise _InvalidEquation()  # more digits than python converts (sys.get_int_max_str_digits())
+
+
+class _InvalidEquation(Exception):
+    pass
+
+
+_DIGITS = frozenset("0123456789")
+
+
+def _next_frame(frame: _Frame, character: str) -> _Frame:
+    """
+    Returns the parser state after the given character or raises _InvalidEquation / ArithmeticError.
+    """
+    if character in _DIGITS or character == ".":
+        if frame.factor is not None or (character == "." and frame.number is not None and "." in frame.number):
+            raise _InvalidEquation()
+        return frame.replace(number=(frame.number or "") + character)
+
+    if frame.number == ".":  # a single "." is not a number
+        raise _InvalidEquation()
+
+    if character == "(":
+        if frame.has_operand():
+            raise _InvalidEquation()
+        return _Frame(parent=frame)
+
+    if character == ")":
+        if frame.parent is None or not frame.has_operand():
+            raise _InvalidEquation()
+        return frame.parent.replace(factor=frame.finish())
+
+    if character in "+-":
+        if not frame.has_operand():
+            # unary plus / minus
+            return frame.replace(negate=frame.negate != (character == "-"))
+        term_value = frame.finish_term()
+        sum_value = term_value if frame.sum_value is None else (
+            frame.sum_value + term_value if frame.add_operator == "+" else frame.sum_value - term_value)
+        return _Frame(sum_value=sum_value, add_operator=character, parent=frame.parent)
+
+    if character in "*/":
+        if not frame.has_operand():
+            raise _InvalidEquation()
+        return frame.replace(term_value=frame.finish_term(), mul_operator=character, negate=False, number=None,
+                             factor=None)
+
+    raise _InvalidEquation()
+
+
+class IncrementalEvaluator:
+    """
+    Keeps the parser state of the calculator equation up to date while it is typed. Adding or deleting a character
+    costs O(1) and the (preview) result can be read at any time without parsing the equation again.
+    """
+
+    def __init__(self):
+        self.__states = [_Frame()]  # one state per typed character; None marks an invalid equation
+        self.__text_length = 0
+
+    def __len__(self):
+        return self.__text_length
+
+    def add(self, text: str) -> None:
+        """
+        Adds the given characters to the end of the equation.
+        """
+        for character in text:
+            state = self.__states[-1]
+            if state is not None:
+                try:
+                    state = _next_frame(state, character)
+                except (_InvalidEquation, ArithmeticError):
+                    state = None  # stays invalid until the character is deleted again
+            self.__states.append(state)
+            self.__text_length += 1
+
+    def delete_last(self) -> None:
+        """
+        Removes the last character of the equation (the DEL command).
+        """
+        if self.__text_length > 0:
+            self.__states.pop()
+            self.__text_length -= 1
+
+    def clear(self) -> None:
+        self.__states = [_Frame()]
+        self.__text_length = 0
+
+    def is_valid(self) -> bool:
+        """
+        Returns whether the equation typed so far can still become a valid equation.
+        """
+        return self.__states[-1] is not None
+
+    def __value(self, close_parentheses: bool):
+        frame = self.__states[-1]
+        if frame is None or not frame.has_operand() or frame.number == ".":
+            return None
+        if frame.parent is not None and not close_parentheses:
+            return None
+        try:
+            value = frame.finish()
+            while frame.parent is not None:
+                frame = frame.parent.replace(factor=value)
+                value = frame.finish()
+            return value
+        except (_InvalidEquation, ArithmeticError):
+            return None
+
+    def preview(self):
+        """
+        Returns the current value of the equation with all open parentheses closed, or None if the equation is
+        incomplete (e.g. ends with an operator) or invalid.
+        """
+        return self.__value(close_parentheses=True)
+
+    def result(self) -> str:
+        """
+        Returns the result of the whole equation as a string, or "Err" if the equation can't be solved.
+        """
+        value = self.__value(close_parentheses=False)
+        if value is None:
+            return "Err"
+        try:
+            return str(value)
+        except ValueError:
+            return "Err"  # the result has more digits than python converts to a string
@@ -0,0 +1,313 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+A fixed-width binary format for the calculator logs (same schema as the csv files written by the CalculatorLogger).
+
+Parsing the text timestamps of large csv logs is slow, so the logs can be converted into this format once and then
+opened with numpy.memmap. Every column of the opened log is a view on the mapped file, nothing has to be parsed.
+
+File layout:
+    8 bytes   magic number b"CALCLOG1"
+    4 bytes   little endian uint32: length of the json header in bytes (including the padding)
+    n bytes   utf-8 json header with the column names and the string tables of the categorical columns, padded with
+              spaces to a multiple of 16 bytes
+    ...       the records, 16 bytes each (see RECORD_DTYPE), or 24 bytes each if the log has the timeStampNs column
+              (see RECORD_DTYPE_NS, format version 2)
+
+The csv logs written by the background writer of the CalculatorLogger have a sidecar index (<log file>.idx) with the
+byte offsets of the sessions and task boundaries, read_task() uses it to parse only the rows of a single task.
+
+Usage:
+    python calculator_log_format.py klm_k_log.csv klm_k_log.calclog    (csv -> binary)
+    python calculator_log_format.py klm_k_log.calclog klm_k_log.csv    (binary -> csv)
+"""
+
+import io
+import os
+import sys
+import json
+import struct
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from calculator_logger import SESSION_STARTED, log_index_file_name
+
+
+MAGIC = b"CALCLOG1"
+FORMAT_VERSION = 2  # version 2 added the optional timeStampNs column, logs without it are still written as version 1
+BINARY_LOG_EXTENSION = ".calclog"
+
+# isMouse is stored as int8 so it can hold a missing value (e.g. for task_started events) as well
+IS_MOUSE_MISSING = -1
+
+RECORD_DTYPE = np.dtype([
+    ("timeStamp", "<f8"),
+    ("eventType", "i1"),
+    ("isMouse", "i1"),
+    ("klmId", "i1"),
+    ("reserved", "i1"),
+    ("argument", "<i2"),
+    ("padding", "V2"),
+])
+
+# records of logs with the integer nanosecond timestamps (the timeStampNs column of the csv logs)
+RECORD_DTYPE_NS = np.dtype(RECORD_DTYPE.descr + [("timeStampNs", "<i8")])
+
+_HEADER_ALIGNMENT = 16
+_PREFIX = struct.Struct("<8sI")
+
+
+def _to_codes(column: pd.Series, max_code: int) -> tuple[np.ndarray, list]:
+    """
+    Converts a categorical column to integer codes (-1 for missing values) and the list of its categories.
+    """
+    categorical = column if isinstance(column.dtype, pd.CategoricalDtype) else column.astype("category")
+    categories = categorical.cat.categories.tolist()
+    if len(categories) > max_code:
+        raise ValueError(f"Column {column.name} has too many different values for the binary log format!")
+    return categorical.cat.codes.to_numpy(), categories
+
+
+def _is_mouse_codes(column: pd.Series) -> np.ndarray:
+    missing = column.isna().to_numpy()
+    is_mouse = np.full(len(column), IS_MOUSE_MISSING, dtype=np.int8)
+    # depending on the missing values the column is read as bool or object (True / False / NaN) by pd.read_csv()
+    is_mouse[~missing] = column[~missing].astype(str).isin(("True", "1", "1.0")).to_numpy()
+    return is_mouse
+
+
+def write_binary_log(data_frame: pd.DataFrame, file_name: str) -> None:
+    """
+    Writes a DataFrame in the calculator log schema (timeStamp, eventType, isMouse, klmId, button/argument and
+    optionally timeStampNs) to a binary log file.
+
+    :param data_frame: the log data, e.g. from pd.read_csv() or EventStore.to_dataframe()
+    :param file_name: the path of the binary log file to create
+    """
+    columns = list(data_frame.columns)
+    if len(columns) not in (5, 6):
+        raise ValueError(f"Expected the columns of the calculator log schema but got {columns}!")
+    time_stamp_column, event_type_column, is_mouse_column, klm_id_column, argument_column = columns[:5]
+    has_time_stamps_ns = len(columns) == 6
+
+    records = np.zeros(len(data_frame), dtype=RECORD_DTYPE_NS if has_time_stamps_ns else RECORD_DTYPE)
+    records["timeStamp"] = data_frame[time_stamp_column].to_numpy(dtype=np.float64)
+    records["eventType"], event_types = _to_codes(data_frame[event_type_column], np.iinfo(np.int8).max)
+    records["isMouse"] = _is_mouse_codes(data_frame[is_mouse_column])
+    records["klmId"], klm_ids = _to_codes(data_frame[klm_id_column], np.iinfo(np.int8).max)
+    records["argument"], arguments = _to_codes(data_frame[argument_column], np.iinfo(np.int16).max)
+    if has_time_stamps_ns:
+        records["timeStampNs"] = data_frame[columns[5]].to_numpy(dtype=np.int64)
+
+    header = json.dumps({
+        "version": FORMAT_VERSION if has_time_stamps_ns else 1,
+        "columns": columns,
+        "event_types": event_types,
+        "klm_ids": klm_ids,
+        "arguments": arguments,
+    }).encode("utf-8")
+    # pad the header so the records start at an aligned offset
+    header += b" " * (-(_PREFIX.size + len(header)) % _HEADER_ALIGNMENT)
+
+    with open(file_name, "wb") as log_file:
+        log_file.write(_PREFIX.pack(MAGIC, len(header)))
+        log_file.write(header)
+        log_file.write(records.tobytes())
+
+
+class BinaryLog:
+    """
+    A binary calculator log opened with numpy.memmap. The column properties are zero-copy views on the mapped records.
+    """
+
+    def __init__(self, file_name: str):
+        with open(file_name, "rb") as log_file:
+            magic, header_length = _PREFIX.unpack(log_file.read(_PREFIX.size))
+            if magic != MAGIC:
+                raise ValueError(f"{file_name} is not a binary calculator log!")
+            header = json.loads(log_file.read(header_length).decode("utf-8"))
+        if header["version"] > FORMAT_VERSION:
+            raise ValueError(f"{file_name} was written by a newer version of the binary log format!")
+
+        self.file_name = file_name
+        self.columns = header["columns"]
+        self.event_types = header["event_types"]
+        self.klm_ids = header["klm_ids"]
+        self.arguments = header["arguments"]
+
+        record_dtype = RECORD_DTYPE_NS if len(self.columns) == 6 else RECORD_DTYPE
+        data_offset = _PREFIX.size + header_length
+        record_count = (os.path.getsize(file_name) - data_offset) // record_dtype.itemsize
+        if record_count > 0:
+            self.records = np.memmap(file_name, dtype=record_dtype, mode="r", offset=data_offset,
+                                     shape=(record_count,))
+        else:
+            # np.memmap can't map an empty region
+            self.records = np.zeros(0, dtype=record_dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def time_stamps(self) -> np.ndarray:
+        return self.records["timeStamp"]
+
+    @property
+    def time_stamps_ns(self) -> np.ndarray:
+        """
+        The integer nanosecond timestamps or None for logs that were recorded without them.
+        """
+        return self.records["timeStampNs"] if "timeStampNs" in self.records.dtype.names else None
+
+    @property
+    def event_type_codes(self) -> np.ndarray:
+        return self.records["eventType"]
+
+    @property
+    def is_mouse_codes(self) -> np.ndarray:
+        return self.records["isMouse"]
+
+    @property
+    def klm_id_codes(self) -> np.ndarray:
+        return self.records["klmId"]
+
+    @property
+    def argument_codes(self) -> np.ndarray:
+        return self.records["argument"]
+
+    def event_type_code(self, event_type: str) -> int:
+        """
+        Returns the code of the given event type (or -1 if it doesn't occur in this log), so the code columns can be
+        filtered directly, e.g. log.event_type_codes == log.event_type_code("keyStroke").
+        """
+        return self.event_types.index(event_type) if event_type in self.event_types else -1
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Returns the log as a DataFrame in the same schema as pd.read_csv() would for the csv log. The categorical
+        columns are backed by the code columns of the file.
+        """
+        is_mouse_codes = self.is_mouse_codes
+        is_mouse = pd.arrays.BooleanArray(is_mouse_codes == 1, is_mouse_codes == IS_MOUSE_MISSING)
+        time_stamp_column, event_type_column, is_mouse_column, klm_id_column, argument_column = self.columns[:5]
+        data = {
+            time_stamp_column: self.time_stamps,
+            event_type_column: pd.Categorical.from_codes(self.event_type_codes, categories=self.event_types),
+            is_mouse_column: is_mouse,
+            klm_id_column: pd.Categorical.from_codes(self.klm_id_codes, categories=self.klm_ids),
+            argument_column: pd.Categorical.from_codes(self.argument_codes, categories=self.arguments),
+        }
+        if len(self.columns) == 6:
+            data[self.columns[5]] = self.time_stamps_ns
+        return pd.DataFrame(data, copy=False)
+
+
+def _relative_seconds(time_stamps_ns: np.ndarray) -> np.ndarray:
+    if len(time_stamps_ns) == 0:
+        return np.zeros(0, dtype=np.float64)
+    return (time_stamps_ns - time_stamps_ns[0]) / 1e9
+
+
+def event_times(log: pd.DataFrame) -> np.ndarray:
+    """
+    Returns the event times of a log in seconds for calculating durations. If the log has the integer timeStampNs
+    column, the times are calculated from it relative to the first event (the differences are exact then); for older
+    logs the float timeStamp column is returned.
+    """
+    if "timeStampNs" in log.columns:
+        return _relative_seconds(log["timeStampNs"].to_numpy(dtype=np.int64))
+    return log["timeStamp"].to_numpy(dtype=np.float64)
+
+
+def is_binary_log(file_name: str) -> bool:
+    with open(file_name, "rb") as log_file:
+        return log_file.read(len(MAGIC)) == MAGIC
+
+
+def read_log(file_name: str) -> pd.DataFrame:
+    """
+    Reads a calculator log in either the csv or the binary format. Can be used in the notebooks instead of
+    pd.read_csv().
+    """
+    if is_binary_log(file_name):
+        return BinaryLog(file_name).to_dataframe()
+    return pd.read_csv(file_name)
+
+
+def read_log_index(file_name: str) -> pd.DataFrame:
+    """
+    Reads the sidecar index of a csv log (see calculator_logger.LogIndex): the byte offsets of the session starts and
+    task boundaries. Entries that point behind the end of the log (their rows never reached the disk) are dropped.
+    """
+    index = pd.read_csv(log_index_file_name(file_name), dtype={"argument": str})
+    return index[index["offset"] < os.path.getsize(file_name)].reset_index(drop=True)
+
+
+def read_log_range(file_name: str, start: int, end: int = None) -> pd.DataFrame:
+    """
+    Reads the rows of a csv log between two byte offsets (e.g. from read_log_index()) without parsing the rest.
+    """
+    with open(file_name, "rb") as log_file:
+        header = log_file.readline()
+        log_file.seek(max(start, len(header)))
+        data = log_file.read() if end is None else log_file.read(max(0, end - log_file.tell()))
+    return pd.read_csv(io.BytesIO(header + data), float_precision="round_trip")
+
+
+def read_task(file_name: str, condition, occurrence: int = -1) -> pd.DataFrame:
+    """
+    Reads the rows of one task of an experiment log, from its task_started event up to and including the
+    task_finished event, by seeking to the offsets in the sidecar index.
+
+    :param condition: the condition of the task (the argument of its task_started event)
+    :param occurrence: which task with this condition to read if there are several (default: the last one)
+    """
+    index = read_log_index(file_name)
+    starts = np.flatnonzero((index["eventType"] == "task_started").to_numpy() &
+                            (index["argument"] == str(condition)).to_numpy())
+    if len(starts) == 0:
+        raise ValueError(f"There is no task with the condition {condition} in the index of {file_name}!")
+    start = starts[occurrence]
+    following = index["eventType"].to_numpy()[start + 1:]
+    ends = np.flatnonzero(np.isin(following, ("task_finished", "task_started", SESSION_STARTED)))
+    end = None
+    if len(ends):
+        # the task ends with the row of its task_finished event, so read up to the next entry after it (an unfinished
+        # task ends where the next task or session starts)
+        end_entry = start + 1 + ends[0] + int(following[ends[0]] == "task_finished")
+        end = int(index["offset"].iloc[end_entry]) if end_entry < len(index) else None
+    rows = read_log_range(file_name, int(index["offset"].iloc[start]), end)
+    finished_rows = np.flatnonzero(rows["eventType"].to_numpy() == "task_finished")
+    return rows.iloc[:finished_rows[0] + 1] if len(finished_rows) else rows
+
+
+def csv_to_binary(csv_file: str, binary_file: str) -> None:
+    write_binary_log(pd.read_csv(csv_file, float_precision="round_trip"), binary_file)
+
+
+def binary_to_csv(binary_file: str, csv_file: str) -> None:
+    BinaryLog(binary_file).to_dataframe().to_csv(csv_file, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts calculator logs between the csv and the binary format. "
+                                                 "The direction is determined by the format of the input file.")
+    parser.add_argument("input_file", help="A calculator log in the csv or the binary format", type=str)
+    parser.add_argument("output_file", help="The file the converted log is written to", type=str)
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.input_file):
+        sys.stderr.write("Given log file does not exist!")
+        exit(1)
+
+    if is_binary_log(args.input_file):
+        binary_to_csv(args.input_file, args.output_file)
+    else:
+        csv_to_binary(args.input_file, args.output_file)
+
+
+if __name__ == '__main__':
+    main()
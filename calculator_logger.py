@@ -0,0 +1,923 @@
+"""
+The CalculatorLogger used by calculator.py and calculator_experiment.py and its logging backends.
+"""
+
+import os
+import sys
+import csv
+import json
+import queue
+import atexit
+import socket
+import threading
+import time
+
+import numpy as np
+
+from instrumentation import instrument
+from mouse_trajectory import TRAJECTORY_COLUMNS
+
+
+class _SyncRequest:
+    """
+    Marker put into the writer queue to request a flush + fsync. The event is set as soon as every row queued before
+    the request has reached the disk.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        # set to False by the NetworkLogWriter if the collector didn't confirm the rows
+        self.succeeded = True
+
+
+class _RowBatch:
+    """
+    Several rows that were queued at once with write_rows().
+    """
+    __slots__ = ("rows",)
+
+    def __init__(self, rows):
+        self.rows = rows
+
+
+_STOP = object()  # marker that tells the writer thread to finish
+
+# integer nanoseconds since the epoch; logged next to the float timeStamp (seconds) which is kept for old readers
+TIME_STAMP_NS_COLUMN = "timeStampNs"
+
+
+def read_log_header(log_file_name: str):
+    """
+    Returns the column names of an existing csv log or None if the file doesn't exist or is empty. Only the first line
+    is read.
+    """
+    if not os.path.isfile(log_file_name) or os.path.getsize(log_file_name) == 0:
+        return None
+    with open(log_file_name, newline="") as log_file:
+        return next(csv.reader(log_file), None)
+
+
+# how far from the end of an existing log resume_log() looks for the last complete record
+_TAIL_BLOCK_SIZE = 64 * 1024
+
+
+def resume_log(log_file_name: str, columns: list[str]) -> list[str]:
+    """
+    Prepares an existing csv log for appending without reading all of it: only the header and the last record are
+    checked. A last record without a line break (the session crashed while writing it) is cut off, together with the
+    entries of the sidecar index that point behind the new end of the file.
+
+    :param columns: the columns of a new log; an existing log may also have the first five of them (a log that was
+                    started before the timeStampNs column existed)
+    :return: the columns the rows have to be written with
+    :raises ValueError: if the existing log has other columns or its last record is broken
+    """
+    header = read_log_header(log_file_name)
+    if header is None:
+        return list(columns)
+    if header != list(columns) and header != list(columns[:5]):
+        raise ValueError(f"{log_file_name} has the columns {header}, expected {columns}!")
+
+    with open(log_file_name, "r+b") as log_file:
+        size = log_file.seek(0, os.SEEK_END)
+        tail_start = max(0, size - _TAIL_BLOCK_SIZE)
+        log_file.seek(tail_start)
+        tail = log_file.read()
+        if not tail.endswith(b"\n"):
+            complete_size = tail_start + tail.rfind(b"\n") + 1
+            if complete_size <= tail_start:
+                raise ValueError(f"{log_file_name} doesn't end with a complete record!")
+            sys.stderr.write(f"Removing the incomplete last record of {log_file_name}\n")
+            log_file.truncate(complete_size)
+            tail = tail[:complete_size - tail_start]
+            _truncate_log_index(log_index_file_name(log_file_name), complete_size)
+
+    lines = tail.splitlines()
+    if len(lines) > 1 or tail_start > 0:
+        last_record = next(csv.reader([lines[-1].decode("utf-8")]))
+        if len(last_record) != len(header):
+            raise ValueError(f"The last record of {log_file_name} has {len(last_record)} fields instead of "
+                             f"{len(header)}!")
+    return header
+
+
+# events after which analysis code may want to start reading a log (see calculator_log_format.read_task())
+INDEXED_EVENTS = ("task_started", "task_restarted", "task_finished")
+SESSION_STARTED = "session_started"
+LOG_INDEX_COLUMNS = ["offset", "eventType", "argument", TIME_STAMP_NS_COLUMN]
+
+
+def log_index_file_name(log_file_name: str) -> str:
+    return f"{log_file_name}.idx"
+
+
+def _truncate_log_index(index_file_name: str, size: int) -> None:
+    if not os.path.isfile(index_file_name):
+        return
+    with open(index_file_name, newline="") as index_file:
+        rows = list(csv.reader(index_file))
+    with open(index_file_name, "w", newline="") as index_file:
+        csv.writer(index_file, lineterminator="\n").writerows(
+            row for row in rows if not row[0].isdigit() or int(row[0]) < size)
+
+
+class LogIndex:
+    """
+    Writes the sidecar index of a csv log (<log file>.idx): a small csv file with the byte offset of every session
+    start and every task boundary event in the log, so analysis code can seek directly to a task instead of parsing
+    the whole log. Used by the BackgroundLogWriter, which knows the offsets of the rows it writes.
+    """
+
+    def __init__(self, log_file_name: str, columns: list[str]):
+        self.file_name = log_index_file_name(log_file_name)
+        self.event_column = columns.index("eventType")
+        self.argument_column = 4  # "button" in calculator.py, "argument" in calculator_experiment.py
+        self.time_stamp_ns_column = columns.index(TIME_STAMP_NS_COLUMN) if TIME_STAMP_NS_COLUMN in columns else None
+        write_header = not os.path.isfile(self.file_name) or os.path.getsize(self.file_name) == 0
+        self.__file = open(self.file_name, "a", newline="")
+        self.__csv_writer = csv.writer(self.__file, lineterminator="\n")
+        if write_header:
+            self.__csv_writer.writerow(LOG_INDEX_COLUMNS)
+
+    def is_indexed(self, row: list) -> bool:
+        return row[self.event_column] in INDEXED_EVENTS
+
+    def add_session(self, offset: int) -> None:
+        self.__csv_writer.writerow([offset, SESSION_STARTED, "", time.time_ns()])
+
+    def add_row(self, offset: int, row: list) -> None:
+        time_stamp_ns = row[self.time_stamp_ns_column] if self.time_stamp_ns_column is not None else ""
+        self.__csv_writer.writerow([offset, row[self.event_column], row[self.argument_column], time_stamp_ns])
+
+    def flush(self, sync: bool = False) -> None:
+        self.__file.flush()
+        if sync:
+            os.fsync(self.__file.fileno())
+
+    def close(self) -> None:
+        self.__file.close()
+
+
+class SessionClock:
+    """
+    High-resolution timestamps for the logged events in integer nanoseconds since the epoch. The wall clock is only
+    read once when the clock is created, all later timestamps are measured from there with the monotonic
+    time.perf_counter_ns(), so they have sub-microsecond resolution and can't jump (e.g. on NTP adjustments).
+
+    The timestamps of Qt input events (QInputEvent.timestamp(): milliseconds on an unspecified monotonic clock) are
+    mapped onto the same time axis. The offset between both clocks is estimated as the smallest observed difference
+    between the time an event is handled and its Qt timestamp, as an event can't be handled before it happened. This
+    way the time the event was waiting in the Qt event loop doesn't end up in the log.
+    """
+
+    # an event that seems to be older than this is assumed to come from a clock that was reset, so the offset is
+    # estimated again
+    MAX_EVENT_DELAY_NS = 1_000_000_000
+
+    def __init__(self):
+        self.__wall_clock_anchor_ns = time.time_ns()
+        self.__perf_counter_anchor_ns = time.perf_counter_ns()
+        self.__event_clock_offset_ns = None
+        self.__last_time_stamp_ns = 0
+
+    @property
+    def anchor_ns(self) -> int:
+        """
+        The wall clock time the clock was started at (the start of the session).
+        """
+        return self.__wall_clock_anchor_ns
+
+    def now_ns(self) -> int:
+        return self.__monotonic(self.__wall_clock_anchor_ns + time.perf_counter_ns() - self.__perf_counter_anchor_ns)
+
+    def event_time_ns(self, event_time_stamp_ms: int = None) -> int:
+        """
+        Returns the time of a Qt input event given its timestamp() in milliseconds. Falls back to the current time for
+        events without a timestamp (None or 0, e.g. synthesized events).
+        """
+        now_ns = self.__wall_clock_anchor_ns + time.perf_counter_ns() - self.__perf_counter_anchor_ns
+        if not event_time_stamp_ms:
+            return self.__monotonic(now_ns)
+        event_time_ns = event_time_stamp_ms * 1_000_000
+        offset_ns = self.__event_clock_offset_ns
+        if offset_ns is None or now_ns - event_time_ns < offset_ns or \
+                now_ns - (event_time_ns + offset_ns) > self.MAX_EVENT_DELAY_NS:
+            offset_ns = self.__event_clock_offset_ns = now_ns - event_time_ns
+        return self.__monotonic(event_time_ns + offset_ns)
+
+    def __monotonic(self, time_stamp_ns: int) -> int:
+        # the event timestamps only have a millisecond resolution, so they must not put an event before the previous
+        # one that was stamped with the perf counter
+        if time_stamp_ns < self.__last_time_stamp_ns:
+            return self.__last_time_stamp_ns
+        self.__last_time_stamp_ns = time_stamp_ns
+        return time_stamp_ns
+
+
+class BackgroundLogWriter:
+    """
+    Appends log rows to an open csv file. Rows are put into a bounded queue and written in batches by a separate
+    writer thread, so the Qt GUI thread never has to wait for the disk (unless the queue is full).
+
+    The written file has exactly the same layout as the one created by DataFrame.to_csv(index=False), so existing
+    notebooks can keep reading it with pd.read_csv().
+    """
+
+    def __init__(self, log_file_name: str, columns: list[str], flush_interval: float = 0.5, batch_size: int = 64,
+                 max_queue_size: int = 10000, write_index: bool = False):
+        """
+        :param log_file_name: the csv file the rows are appended to (created with a header if it doesn't exist yet)
+        :param columns: the column names used for the header of a new file
+        :param flush_interval: max. time in seconds a written row may stay in the file buffer before it is flushed
+        :param batch_size: number of rows after which the writer flushes the file without waiting for the interval
+        :param max_queue_size: max. number of rows waiting to be written; write_row() blocks if the queue is full
+        :param write_index: keep the sidecar index of the session and task boundaries up to date (see LogIndex)
+        """
+        self.__log_file_name = log_file_name
+        self.__flush_interval = flush_interval
+        self.__batch_size = max(1, batch_size)
+        self.__queue = queue.Queue(maxsize=max_queue_size)
+        self.__closed = False
+
+        # only write the header if there is no (non-empty) log file yet, otherwise we just continue appending
+        write_header = not os.path.isfile(log_file_name) or os.path.getsize(log_file_name) == 0
+        self.__file = open(log_file_name, "a", newline="")
+        self.__csv_writer = csv.writer(self.__file, lineterminator="\n")
+        if write_header:
+            self.__csv_writer.writerow(columns)
+            self.__file.flush()
+        self.__index = None
+        if write_index:
+            self.__index = LogIndex(log_file_name, columns)
+            self.__index.add_session(self.__file.tell())
+
+        self.__thread = threading.Thread(target=self.__run, name=f"BackgroundLogWriter({log_file_name})", daemon=True)
+        self.__thread.start()
+        # make sure everything ends up on disk even if the application is closed via sys.exit()
+        atexit.register(self.close)
+
+    @property
+    def log_file_name(self) -> str:
+        return self.__log_file_name
+
+    def write_row(self, row: list) -> None:
+        """
+        Queues a single row for writing. Blocks only if the writer thread can't keep up and the queue is full.
+        """
+        if self.__closed:
+            raise ValueError(f"Log writer for {self.__log_file_name} is already closed!")
+        self.__queue.put(row)
+
+    def write_rows(self, rows: list) -> None:
+        """
+        Queues several rows at once, they are always written together in one batch.
+        """
+        if self.__closed:
+            raise ValueError(f"Log writer for {self.__log_file_name} is already closed!")
+        self.__queue.put(_RowBatch(rows))
+
+    def sync(self, timeout: float = None) -> bool:
+        """
+        Waits until all rows queued so far have been written and fsynced to the disk.
+
+        :return: True if the sync finished within the timeout
+        """
+        if self.__closed:
+            return True
+        request = _SyncRequest()
+        self.__queue.put(request)
+        return request.done.wait(timeout)
+
+    def close(self) -> None:
+        """
+        Writes all remaining rows, fsyncs the file and stops the writer thread.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        atexit.unregister(self.close)
+        self.__queue.put(_STOP)
+        self.__thread.join()
+
+    def __run(self) -> None:
+        pending_rows = 0
+        last_flush = time.monotonic()
+        running = True
+
+        while running:
+            try:
+                item = self.__queue.get(timeout=self.__flush_interval)
+            except queue.Empty:
+                item = None
+
+            # collect everything that is already waiting so the rows can be written as one batch
+            batch = []
+            sync_requests = []
+            while item is not None:
+                if item is _STOP:
+                    running = False
+                elif isinstance(item, _SyncRequest):
+                    sync_requests.append(item)
+                elif isinstance(item, _RowBatch):
+                    batch.extend(item.rows)
+                    if len(batch) >= self.__batch_size:
+                        break
+                else:
+                    batch.append(item)
+                    if len(batch) >= self.__batch_size:
+                        break
+                try:
+                    item = self.__queue.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            if batch:
+                self.__write_batch(batch)
+                pending_rows += len(batch)
+
+            now = time.monotonic()
+            if sync_requests or not running:
+                self.__file.flush()
+                os.fsync(self.__file.fileno())
+                if self.__index is not None:
+                    self.__index.flush(sync=True)
+                pending_rows = 0
+                last_flush = now
+                for request in sync_requests:
+                    request.done.set()
+            elif pending_rows and (pending_rows >= self.__batch_size or now - last_flush >= self.__flush_interval):
+                self.__file.flush()
+                if self.__index is not None:
+                    self.__index.flush()
+                pending_rows = 0
+                last_flush = now
+
+        self.__file.close()
+        if self.__index is not None:
+            self.__index.close()
+
+    def __write_batch(self, batch: list) -> None:
+        if self.__index is None:
+            self.__csv_writer.writerows(batch)
+            return
+        # the rows before an indexed row are written first, so its offset is the current end of the file
+        start = 0
+        for position, row in enumerate(batch):
+            if self.__index.is_indexed(row):
+                self.__csv_writer.writerows(batch[start:position])
+                self.__index.add_row(self.__file.tell(), row)
+                start = position
+        self.__csv_writer.writerows(batch[start:])
+
+
+# e.g. "tcp://127.0.0.1:8765" or "unix:///tmp/calculator_logs.sock", see log_collector.py
+LOG_SINK_ENV_VARIABLE = "CALCULATOR_LOG_SINK"
+
+# max. number of rows sent in one message to the collector
+_MAX_ROWS_PER_MESSAGE = 1000
+# the sender asks the collector for a confirmation after this many unconfirmed rows at the latest
+_MAX_UNACKNOWLEDGED_ROWS = 10000
+
+
+def connect_to_log_sink(address: str, timeout: float = 2.0) -> socket.socket:
+    """
+    Opens a connection to a log collector at the given address ("tcp://host:port" or "unix:///path/to/socket").
+    """
+    if address.startswith("unix://"):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(timeout)
+        try:
+            connection.connect(address[len("unix://"):])
+        except OSError:
+            connection.close()
+            raise
+    elif address.startswith("tcp://"):
+        host, port = address[len("tcp://"):].rsplit(":", 1)
+        connection = socket.create_connection((host.strip("[]"), int(port)), timeout)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    else:
+        raise ValueError(f"Unsupported log sink address {address} (expected tcp://host:port or unix:///path)!")
+    connection.settimeout(None)
+    return connection
+
+
+class NetworkLogWriter:
+    """
+    Streams log rows to a log collector (see log_collector.py) instead of writing them to a local file. Has the same
+    interface as BackgroundLogWriter, so the CalculatorLogger can use either of them.
+
+    The rows are queued and sent in batches by a separate thread as json lines. If the collector can't keep up, it
+    stops reading from the connection, so the sender thread waits and the rows pile up in the queue; the GUI thread
+    never waits for the collector. If the queue is full anyway or the connection is lost, the rows are written to the
+    local log file instead (with a warning), so nothing gets lost. The same happens if the collector accepts the rows
+    but stops answering for longer than ack_timeout; all rows it hasn't confirmed yet are written to the local file
+    then (some of them may end up in both files).
+    """
+
+    def __init__(self, address: str, log_file_name: str, columns: list[str], flush_interval: float = 0.5,
+                 batch_size: int = 64, max_queue_size: int = 10000, sync_timeout: float = 1.0,
+                 ack_timeout: float = 5.0):
+        """
+        :param address: the address of the collector, e.g. "tcp://127.0.0.1:8765" (see connect_to_log_sink())
+        :param log_file_name: the file the collector writes the rows to (only the file name is used), also the local
+                              fallback file
+        :param columns: the column names of the log
+        :param flush_interval: max. time in seconds a row waits before it is sent
+        :param batch_size: number of rows after which they are sent without waiting for the interval
+        :param max_queue_size: max. number of rows waiting to be sent before the local fallback file is used
+        :param sync_timeout: max. time in seconds sync() waits for the collector if no timeout is given
+        :param ack_timeout: max. time in seconds the sender thread waits for the collector (to accept the sent rows or
+                            to confirm them) before it switches to the local file; close() waits about as long
+        :raises OSError: if the collector can't be reached
+        """
+        self.__log_file_name = log_file_name
+        self.__columns = list(columns)
+        self.__flush_interval = flush_interval
+        self.__batch_size = max(1, batch_size)
+        self.__sync_timeout = sync_timeout
+        self.__ack_timeout = ack_timeout
+        self.__queue = queue.Queue(maxsize=max_queue_size)
+        self.__closed = False
+        self.__fallback_writer = None
+        self.__fallback_lock = threading.Lock()
+        # number of rows that were written to the local fallback file
+        self.fallback_rows = 0
+
+        self.__connection = connect_to_log_sink(address)
+        self.__connection.settimeout(ack_timeout)
+        self.__responses = self.__connection.makefile("rb")
+        self.__send({"type": "hello", "log_file": os.path.basename(log_file_name), "columns": self.__columns,
+                     "pid": os.getpid()})
+
+        self.__thread = threading.Thread(target=self.__run, name=f"NetworkLogWriter({address})", daemon=True)
+        self.__thread.start()
+        atexit.register(self.close)
+
+    @property
+    def log_file_name(self) -> str:
+        return self.__log_file_name
+
+    def write_row(self, row: list) -> None:
+        """
+        Queues a single row for sending. Never blocks: if the queue is full, the row is written to the local file.
+        """
+        if self.__closed:
+            raise ValueError(f"Log writer for {self.__log_file_name} is already closed!")
+        try:
+            self.__queue.put_nowait(row)
+        except queue.Full:
+            self.__write_fallback([row], "the collector can't keep up")
+
+    def write_rows(self, rows: list) -> None:
+        """
+        Queues several rows at once, they are always sent together.
+        """
+        if self.__closed:
+            raise ValueError(f"Log writer for {self.__log_file_name} is already closed!")
+        try:
+            self.__queue.put_nowait(_RowBatch(rows))
+        except queue.Full:
+            self.__write_fallback(rows, "the collector can't keep up")
+
+    def sync(self, timeout: float = None) -> bool:
+        """
+        Waits until the collector confirmed that all rows queued so far have been written and fsynced. The wait is
+        bounded (by sync_timeout if no timeout is given), a collector that is behind can't freeze the GUI.
+
+        :return: True if the collector confirmed the rows within the timeout (False if the connection broke, the rows
+                 are written to the local file then)
+        """
+        if self.__closed:
+            return True
+        if timeout is None:
+            timeout = self.__sync_timeout
+        request = _SyncRequest()
+        try:
+            self.__queue.put(request, timeout=timeout)
+        except queue.Full:
+            return False
+        return request.done.wait(timeout) and request.succeeded
+
+    def close(self) -> None:
+        """
+        Sends all remaining rows, closes the connection and stops the sender thread.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        atexit.unregister(self.close)
+        # close() runs on the GUI thread (closeEvent / atexit), so a collector that stopped answering can't block it:
+        # after ack_timeout the connection is aborted and the sender thread writes the remaining rows locally
+        try:
+            self.__queue.put(_STOP, timeout=self.__ack_timeout)
+        except queue.Full:
+            self.__abort_connection()
+            self.__queue.put(_STOP)
+        self.__thread.join(self.__ack_timeout)
+        if self.__thread.is_alive():
+            self.__abort_connection()
+            self.__thread.join(self.__ack_timeout)
+            if self.__thread.is_alive():
+                sys.stderr.write(f"The log writer for {self.__log_file_name} didn't stop in time!\n")
+                return  # the fallback writer is still in use, it is closed at exit
+        if self.__fallback_writer is not None:
+            self.__fallback_writer.close()
+
+    def __send(self, message: dict) -> None:
+        self.__connection.sendall(json.dumps(message, separators=(",", ":")).encode("utf-8") + b"\n")
+
+    def __write_fallback(self, rows: list, reason: str) -> None:
+        with self.__fallback_lock:
+            if self.__fallback_writer is None:
+                sys.stderr.write(f"Writing the log to {self.__log_file_name} locally, {reason}!\n")
+                self.__fallback_writer = BackgroundLogWriter(self.__log_file_name, self.__columns,
+                                                             self.__flush_interval, self.__batch_size)
+            self.__fallback_writer.write_rows(rows)
+            self.fallback_rows += len(rows)
+
+    def __run(self) -> None:
+        connected = True
+        running = True
+        pending_rows = []
+        # rows that were sent but not confirmed by a "synced" answer yet, they go to the fallback file if the
+        # connection breaks before the answer arrives
+        unacknowledged_rows = []
+        last_send = time.monotonic()
+
+        while running:
+            try:
+                item = self.__queue.get(timeout=self.__flush_interval)
+            except queue.Empty:
+                item = None
+
+            sync_requests = []
+            while item is not None:
+                if item is _STOP:
+                    running = False
+                elif isinstance(item, _SyncRequest):
+                    sync_requests.append(item)
+                elif isinstance(item, _RowBatch):
+                    pending_rows.extend(item.rows)
+                else:
+                    pending_rows.append(item)
+                try:
+                    item = self.__queue.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            now = time.monotonic()
+            if running and not sync_requests and (not pending_rows or (
+                    len(pending_rows) < self.__batch_size and now - last_send < self.__flush_interval)):
+                continue
+
+            if connected:
+                try:
+                    for start in range(0, len(pending_rows), _MAX_ROWS_PER_MESSAGE):
+                        self.__send({"type": "rows", "rows": pending_rows[start:start + _MAX_ROWS_PER_MESSAGE]})
+                    unacknowledged_rows.extend(pending_rows)
+                    pending_rows = []
+                    if sync_requests or not running or len(unacknowledged_rows) >= _MAX_UNACKNOWLEDGED_ROWS:
+                        self.__round_trip("sync" if running else "close")
+                        unacknowledged_rows = []
+                except (OSError, ValueError) as error:
+                    connected = False
+                    self.__close_connection()
+                    for request in sync_requests:
+                        request.succeeded = False
+                    self.__write_fallback(unacknowledged_rows + pending_rows,
+                                          f"the connection to the collector was lost ({error})")
+                    unacknowledged_rows = []
+                    pending_rows = []
+            elif pending_rows:
+                self.__write_fallback(pending_rows, "the connection to the collector was lost")
+                pending_rows = []
+
+            if not connected and sync_requests:
+                self.__fallback_writer.sync()
+            for request in sync_requests:
+                request.done.set()
+            last_send = now
+
+        if connected:
+            self.__close_connection()
+
+    def __round_trip(self, message_type: str) -> None:
+        """
+        Sends a sync or close message and waits until the collector confirmed that it has written all rows before it.
+        """
+        self.__send({"type": message_type})
+        response = self.__responses.readline()
+        if not response or json.loads(response).get("type") != "synced":
+            raise ConnectionError("the collector didn't confirm the rows")
+
+    def __abort_connection(self) -> None:
+        """
+        Makes a send or receive the sender thread is blocked in fail immediately.
+        """
+        try:
+            self.__connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # already closed
+
+    def __close_connection(self) -> None:
+        try:
+            self.__responses.close()
+        except OSError:
+            pass
+        self.__connection.close()
+
+
+class LogEvent:
+    """
+    A single logged calculator event. Uses __slots__ so the records stay small if many of them are created.
+    time_stamp is the event time in seconds (as float) that is logged for compatibility with older logs.
+    """
+    __slots__ = ("time_stamp_ns", "event_type", "is_mouse", "klm_id", "argument", "time_stamp")
+
+    def __init__(self, time_stamp_ns: int, event_type: str, is_mouse, klm_id, argument, time_stamp: float = None):
+        self.time_stamp_ns = time_stamp_ns
+        self.event_type = event_type
+        self.is_mouse = is_mouse
+        self.klm_id = klm_id
+        self.argument = argument
+        self.time_stamp = time_stamp_ns / 1e9 if time_stamp is None else time_stamp
+
+    def as_tuple(self) -> tuple:
+        return self.time_stamp_ns, self.event_type, self.is_mouse, self.klm_id, self.argument, self.time_stamp
+
+    def __eq__(self, other):
+        return isinstance(other, LogEvent) and self.as_tuple() == other.as_tuple()
+
+    def __repr__(self):
+        return f"LogEvent{self.as_tuple()}"
+
+
+class _CodeTable:
+    """
+    Maps the values of a categorical column (e.g. "mouseClick", "keyStroke") to small integer codes and back.
+    None / NaN is always mapped to -1 (the missing value code used by pd.Categorical).
+    """
+
+    def __init__(self, values=(), max_codes=127):
+        self.values = []
+        self.__codes = {}
+        self.__max_codes = max_codes
+        for value in values:
+            self.code(value)
+
+    def code(self, value) -> int:
+        if value is None or value != value:  # value != value is only true for NaN
+            return -1
+        code = self.__codes.get(value)
+        if code is None:
+            code = len(self.values)
+            if code >= self.__max_codes:
+                raise ValueError(f"Too many different values in a categorical log column (max. {self.__max_codes})!")
+            self.__codes[value] = code
+            self.values.append(value)
+        return code
+
+    def value(self, code: int):
+        return None if code < 0 else self.values[code]
+
+
+class EventStore:
+    """
+    Compact in-memory store for the calculator log with a fixed schema. Every column is kept in a preallocated numpy
+    array that grows by doubling its capacity, so appending an event has a constant amortized cost and needs only a
+    few bytes per event:
+
+    - timeStampNs: int64 nanoseconds, timeStamp: float64 seconds (kept as well, so old logs are written back unchanged)
+    - eventType, klmId: int8 codes, argument/button: int16 codes (see _CodeTable)
+    - isMouse: bool values plus a bool mask for missing values (e.g. for the task_started events)
+
+    The columns are the five columns of the old log schema, optionally followed by the timeStampNs column.
+    """
+
+    def __init__(self, columns=("timeStamp", "eventType", "isMouse", "klmId", "argument", TIME_STAMP_NS_COLUMN),
+                 initial_capacity=1024):
+        self.columns = list(columns)
+        self.__size = 0
+        self.__capacity = max(1, initial_capacity)
+        self.__time_stamps = np.empty(self.__capacity, dtype=np.float64)
+        self.__time_stamps_ns = np.empty(self.__capacity, dtype=np.int64)
+        self.__event_types = np.empty(self.__capacity, dtype=np.int8)
+        self.__is_mouse = np.empty(self.__capacity, dtype=np.bool_)
+        self.__is_mouse_missing = np.empty(self.__capacity, dtype=np.bool_)
+        self.__klm_ids = np.empty(self.__capacity, dtype=np.int8)
+        self.__arguments = np.empty(self.__capacity, dtype=np.int16)
+        self.__event_type_table = _CodeTable(("mouseMove", "mouseClick", "keyStroke",
+                                              "task_started", "task_restarted", "task_finished"))
+        self.__klm_id_table = _CodeTable(("Px", "B", "k"))
+        self.__argument_table = _CodeTable(max_codes=np.iinfo(np.int16).max)
+
+    def __len__(self):
+        return self.__size
+
+    def __grow(self) -> None:
+        self.__capacity *= 2
+        for name in ("_EventStore__time_stamps", "_EventStore__time_stamps_ns", "_EventStore__event_types",
+                     "_EventStore__is_mouse", "_EventStore__is_mouse_missing", "_EventStore__klm_ids",
+                     "_EventStore__arguments"):
+            old_array = getattr(self, name)
+            new_array = np.empty(self.__capacity, dtype=old_array.dtype)
+            new_array[:self.__size] = old_array[:self.__size]
+            setattr(self, name, new_array)
+
+    def append(self, time_stamp_ns: int, event_type: str, is_mouse, klm_id, argument,
+               time_stamp: float = None) -> None:
+        """
+        Appends an event. time_stamp (seconds) defaults to time_stamp_ns and only has to be given for events from old
+        logs that only have the float timestamp.
+        """
+        if self.__size == self.__capacity:
+            self.__grow()
+        index = self.__size
+        self.__time_stamps_ns[index] = time_stamp_ns
+        self.__time_stamps[index] = time_stamp_ns / 1e9 if time_stamp is None else time_stamp
+        self.__event_types[index] = self.__event_type_table.code(event_type)
+        missing = is_mouse is None or is_mouse != is_mouse
+        self.__is_mouse[index] = False if missing else bool(is_mouse)
+        self.__is_mouse_missing[index] = missing
+        self.__klm_ids[index] = self.__klm_id_table.code(klm_id)
+        self.__arguments[index] = self.__argument_table.code(argument)
+        self.__size += 1
+
+    def append_event(self, event: LogEvent) -> None:
+        self.append(*event.as_tuple())
+
+    def __getitem__(self, index: int) -> LogEvent:
+        if index < 0:
+            index += self.__size
+        if not 0 <= index < self.__size:
+            raise IndexError("EventStore index out of range")
+        return LogEvent(int(self.__time_stamps_ns[index]),
+                        self.__event_type_table.value(self.__event_types[index]),
+                        None if self.__is_mouse_missing[index] else bool(self.__is_mouse[index]),
+                        self.__klm_id_table.value(self.__klm_ids[index]),
+                        self.__argument_table.value(self.__arguments[index]),
+                        float(self.__time_stamps[index]))
+
+    def __iter__(self):
+        for index in range(self.__size):
+            yield self[index]
+
+    @property
+    def time_stamps(self) -> np.ndarray:
+        return self.__time_stamps[:self.__size]
+
+    @property
+    def time_stamps_ns(self) -> np.ndarray:
+        return self.__time_stamps_ns[:self.__size]
+
+    def to_dataframe(self):
+        """
+        Returns the stored events as a pandas DataFrame with the logger's column names. The numeric columns and the
+        category codes are views on the internal arrays, so no event data is copied.
+        """
+        import pandas as pd
+
+        size = self.__size
+
+        def categorical(codes, table):
+            dtype = pd.CategoricalDtype(table.values)
+            return pd.Categorical.from_codes(codes[:size], dtype=dtype, validate=False)
+
+        is_mouse = pd.arrays.BooleanArray(self.__is_mouse[:size], self.__is_mouse_missing[:size])
+        time_stamp_column, event_type_column, is_mouse_column, klm_id_column, argument_column = self.columns[:5]
+        data = {
+            time_stamp_column: self.__time_stamps[:size],
+            event_type_column: categorical(self.__event_types, self.__event_type_table),
+            is_mouse_column: is_mouse,
+            klm_id_column: categorical(self.__klm_ids, self.__klm_id_table),
+            argument_column: categorical(self.__arguments, self.__argument_table),
+        }
+        if len(self.columns) > 5:
+            data[self.columns[5]] = self.__time_stamps_ns[:size]
+        return pd.DataFrame(data, copy=False)
+
+    @classmethod
+    def from_dataframe(cls, data_frame, columns=None) -> "EventStore":
+        """
+        Creates a store from a DataFrame in the logger schema (e.g. read from an existing log file with pd.read_csv).
+        For old logs without the timeStampNs column the nanoseconds are calculated from the float timestamps.
+        """
+        store = cls(columns or list(data_frame.columns), initial_capacity=max(len(data_frame), 1024))
+        time_stamp_column = store.columns[0]
+        time_stamps = data_frame[time_stamp_column].to_numpy(dtype=np.float64)
+        if TIME_STAMP_NS_COLUMN in data_frame.columns:
+            time_stamps_ns = data_frame[TIME_STAMP_NS_COLUMN].to_numpy(dtype=np.int64)
+        else:
+            time_stamps_ns = np.round(time_stamps * 1e9).astype(np.int64)
+        rows = data_frame[store.columns[1:5]].itertuples(index=False, name=None)
+        for time_stamp_ns, time_stamp, row in zip(time_stamps_ns.tolist(), time_stamps.tolist(), rows):
+            store.append(time_stamp_ns, *row, time_stamp=time_stamp)
+        return store
+
+
+class CalculatorLogger:
+    # timeStamp is the event time in seconds (float) and timeStampNs the same time in integer nanoseconds, log files
+    # that were started before timeStampNs existed are continued without it
+    COLUMNS = ['timeStamp', 'eventType', 'isMouse', 'klmId', 'argument', 'timeStampNs']
+    ARGUMENT_COLUMN = 4
+
+    # if background_writing is set, new rows are only appended to the log file by a separate writer thread instead of
+    # rewriting the whole csv file on every event; flush_interval and batch_size are passed on to the writer;
+    # print_events additionally prints every logged event to stdout; if a log_sink address is given (e.g.
+    # "tcp://127.0.0.1:8765", see log_collector.py), the background writer streams the rows to that collector instead;
+    # argument_column is the name of the column with the pressed button ("button" in calculator.py)
+    def __init__(self, logfile, background_writing=False, flush_interval=0.5, batch_size=64, print_events=False,
+                 log_sink=None, argument_column='argument'):
+        self.__log_file_name = logfile
+        self.__log_columns = list(self.COLUMNS)
+        self.__log_columns[self.ARGUMENT_COLUMN] = argument_column
+        self.__log_sink = log_sink
+        self.__print_events = print_events
+        self.__background_writing = background_writing
+        self.__flush_interval = flush_interval
+        self.__batch_size = batch_size
+        self.__log_writer = None
+        self.__trajectory_writer = None
+        # all events of the session are stamped on this clock (see SessionClock)
+        self.clock = SessionClock()
+        self.__columns = self.__log_columns
+        self.__calculator_data = self.__init_study_data()
+
+    def __init_study_data(self):
+        # only the header and the last record of an existing log are checked (see resume_log())
+        self.__columns = resume_log(self.__log_file_name, self.__log_columns)
+        if self.__background_writing:
+            # the writer only appends to the file so we don't need to load the existing data at all; it also keeps the
+            # index of the session and task boundaries next to the log (see LogIndex)
+            self.__log_writer = None
+            if self.__log_sink:
+                try:
+                    self.__log_writer = NetworkLogWriter(self.__log_sink, self.__log_file_name, self.__columns,
+                                                         flush_interval=self.__flush_interval,
+                                                         batch_size=self.__batch_size)
+                except (OSError, ValueError) as error:
+                    sys.stderr.write(f"Can't connect to the log collector at {self.__log_sink} ({error}), writing "
+                                     f"the log locally!\n")
+            if self.__log_writer is None:
+                self.__log_writer = BackgroundLogWriter(self.__log_file_name, self.__columns,
+                                                        flush_interval=self.__flush_interval,
+                                                        batch_size=self.__batch_size, write_index=True)
+            return EventStore(self.__columns)
+        # the whole file is rewritten on every event in this mode, so the existing data has to be loaded;
+        # pandas is only imported here as it takes a lot of time and is not needed for the background writer
+        import pandas as pd
+
+        # check if the file already exists
+        if os.path.isfile(self.__log_file_name):
+            calculator_data = EventStore.from_dataframe(pd.read_csv(self.__log_file_name, float_precision="round_trip"),
+                                                        self.__columns)
+        else:
+            calculator_data = EventStore(self.__columns)
+        return calculator_data
+
+    def set_logfile_name(self, new_logfile_name):
+        self.close()
+        self.__log_file_name = new_logfile_name
+        self.__calculator_data = self.__init_study_data()
+
+    # time_stamp_ns is the time of the event in nanoseconds on self.clock, None stamps the event with the current time
+    @instrument
+    def add_new_log_data(self, time_stamp_ns, event_type, is_mouse, klm_id, argument):
+        if time_stamp_ns is None:
+            time_stamp_ns = self.clock.now_ns()
+        time_stamp = time_stamp_ns / 1e9
+        if self.__print_events:
+            print(dict(zip(self.__log_columns, [time_stamp, event_type, is_mouse, klm_id, argument, time_stamp_ns])))
+        self.__calculator_data.append(time_stamp_ns, event_type, is_mouse, klm_id, argument, time_stamp)
+        if self.__log_writer is not None:
+            row = [time_stamp, event_type, is_mouse, klm_id, argument, time_stamp_ns]
+            self.__log_writer.write_row(row if len(self.__columns) == len(row) else row[:len(self.__columns)])
+            if event_type == "task_finished":
+                # make sure a finished task is on disk even if the session crashes afterwards
+                self.__log_writer.sync()
+            return
+        self.__calculator_data.to_dataframe().to_csv(self.__log_file_name, index=False)
+
+    # returns the logged events as a pandas DataFrame (without copying the data)
+    def get_log_data(self):
+        return self.__calculator_data.to_dataframe()
+
+    # appends a batch of mouse trajectory samples (see mouse_trajectory.py) to <logfile>_trajectory.csv, they are kept
+    # in a separate file so the event log keeps its schema
+    def add_trajectory_samples(self, samples):
+        if len(samples) == 0:
+            return
+        if self.__trajectory_writer is None:
+            trajectory_file_name = f"{os.path.splitext(self.__log_file_name)[0]}_trajectory.csv"
+            self.__trajectory_writer = BackgroundLogWriter(trajectory_file_name, TRAJECTORY_COLUMNS,
+                                                           flush_interval=self.__flush_interval,
+                                                           batch_size=self.__batch_size)
+        self.__trajectory_writer.write_rows(samples.tolist())
+
+    # writes all pending rows to the disk and stops the background writers (if there are any)
+    def close(self):
+        if self.__log_writer is not None:
+            self.__log_writer.close()
+        if self.__trajectory_writer is not None:
+            self.__trajectory_writer.close()
+            self.__trajectory_writer = None
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Headless replay of recorded calculator logs to measure how much latency the input handlers (including the logging)
+add to every event.
+
+The recorded hovers, mouse clicks and key presses are synthesized with QtTest and sent to a calculator.IttCalculator
+(logs with a "button" column) or calculator_experiment.IttCalculator (logs with an "argument" column) as fast as
+possible. The time every event needs until its handlers return is collected and reported as percentiles. Runs without
+a display by using the Qt "offscreen" platform, so it can be used on a CI machine.
+
+Usage:
+    python calculator_replay.py klm_b_log.csv
+    python calculator_replay.py calculator_experiment_p_3.csv --logger rewrite --repeat 5 -o replay.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+
+import numpy as np
+from PyQt5 import QtWidgets, QtCore, QtGui
+from PyQt5.QtTest import QTest
+
+from calculator_log_format import read_log
+from calculator_logger import CalculatorLogger
+
+
+LOGGER_MODES = ("background", "rewrite")
+
+# keys that don't produce the logged text
+_COMMAND_KEYS = {"=": QtCore.Qt.Key_Return, "DEL": QtCore.Qt.Key_Backspace}
+
+_PARTICIPANT_ID_REGEX = re.compile(r"_p_(\d+)")
+
+
+def _create_calculator(log_columns: list[str], log_file_name: str, output_directory: str, logger_mode: str):
+    """
+    Creates the calculator that fits the given log and lets it log into the output directory.
+    """
+    working_directory = os.getcwd()
+    os.chdir(output_directory)  # the experiment calculator always logs into the current directory
+    try:
+        if "argument" in log_columns:
+            import calculator_experiment as calculator_module
+            match = _PARTICIPANT_ID_REGEX.search(os.path.basename(log_file_name))
+            # the participant id determines the order of the conditions, so it has to be the recorded one
+            calculator = calculator_module.IttCalculator(int(match.group(1)) if match else 0)
+            # don't exit the replay after the last task
+            calculator._experiment_finished = lambda: None
+        else:
+            import calculator as calculator_module
+            calculator = calculator_module.IttCalculator(os.path.join(output_directory, "replay_log.csv"))
+
+        if logger_mode == "rewrite":
+            calculator._calculatorLogger.close()
+            calculator._calculatorLogger = CalculatorLogger(
+                os.path.join(output_directory, "replay_rewrite_log.csv"), background_writing=False,
+                argument_column="argument" if "argument" in log_columns else "button")
+    finally:
+        os.chdir(working_directory)
+    return calculator
+
+
+def _buttons_by_text(calculator) -> dict:
+    return {button.text(): button for button in calculator.findChildren(QtWidgets.QPushButton) if button.text()}
+
+
+def _replay_event(calculator, buttons: dict, event_type: str, argument: str) -> bool:
+    """
+    Synthesizes a single logged event. Returns False if the event can't be replayed (e.g. task_finished events which
+    are logged by the calculator itself).
+    """
+    if event_type == "mouseMove":
+        button = buttons.get(argument)
+        if button is None:
+            return False
+        center = QtCore.QPointF(button.rect().center())
+        QtWidgets.QApplication.sendEvent(button, QtGui.QHoverEvent(QtCore.QEvent.HoverEnter, center, center))
+    elif event_type == "mouseClick":
+        button = buttons.get(argument)
+        if button is None:
+            return False
+        QTest.mouseClick(button, QtCore.Qt.LeftButton)
+    elif event_type == "keyStroke":
+        if argument in _COMMAND_KEYS:
+            QTest.keyClick(calculator, _COMMAND_KEYS[argument])
+        elif len(argument) == 1:
+            QTest.keyClick(calculator, argument)
+        else:
+            return False
+    elif event_type == "task_started":
+        # click the start button of the task description that is currently shown
+        stacked_widget = calculator.stackedWidget
+        start_buttons = [button for button in stacked_widget.currentWidget().findChildren(QtWidgets.QPushButton)
+                         if button.objectName().endswith("_start")]
+        if not start_buttons:
+            return False
+        start_buttons[0].click()
+    else:
+        return False
+    return True
+
+
+def replay_log(log_file_name: str, logger_mode: str = "background", repeat: int = 1, verbose: bool = False) -> dict:
+    """
+    Replays the given log and measures the handler latency of every event.
+
+    :param log_file_name: a calculator log (csv or binary)
+    :param logger_mode: "background" for the append-only background writer, "rewrite" for rewriting the whole csv
+    :param repeat: how often the log is replayed (with a new calculator each time)
+    :param verbose: keep the output the calculator prints for every event
+    :return: a dict with the event counts, the latency percentiles in microseconds and the throughput
+    """
+    log = read_log(log_file_name)
+    log_columns = list(log.columns)
+    events = list(zip(log["eventType"].astype(str), log[log_columns[4]].astype(str)))
+
+    # use the offscreen platform (no display needed) unless another one was chosen explicitly
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    latencies = []
+    latency_by_type = {}
+    skipped_events = 0
+    replay_time = 0.0
+
+    with tempfile.TemporaryDirectory() as output_directory, open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+            for _ in range(repeat):
+                calculator = _create_calculator(log_columns, log_file_name, output_directory, logger_mode)
+                buttons = _buttons_by_text(calculator)
+                app.processEvents()
+
+                start_time = time.perf_counter()
+                for event_type, argument in events:
+                    event_start = time.perf_counter_ns()
+                    replayed = _replay_event(calculator, buttons, event_type, argument)
+                    event_end = time.perf_counter_ns()
+                    if replayed:
+                        latencies.append(event_end - event_start)
+                        latency_by_type.setdefault(event_type, []).append(event_end - event_start)
+                    else:
+                        skipped_events += 1
+                replay_time += time.perf_counter() - start_time
+
+                # the time for writing the rest of the log is not part of the event latency
+                calculator.close()
+                calculator.deleteLater()
+                app.processEvents()
+
+    def percentiles(values) -> dict:
+        values = np.asarray(values, dtype=np.float64) / 1000  # ns -> us
+        if len(values) == 0:
+            return {}
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {"count": int(len(values)), "p50": float(p50), "p95": float(p95), "p99": float(p99),
+                "max": float(values.max()), "mean": float(values.mean())}
+
+    return {
+        "log": log_file_name,
+        "logger": logger_mode,
+        "repeat": repeat,
+        "replayed_events": len(latencies),
+        "skipped_events": skipped_events,
+        "latency_us": percentiles(latencies),
+        "latency_us_by_event_type": {event_type: percentiles(values)
+                                     for event_type, values in sorted(latency_by_type.items())},
+        "throughput_events_per_s": len(latencies) / replay_time if replay_time > 0 else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays calculator logs headless and reports the latency of the "
+                                                 "input handlers.")
+    parser.add_argument("log_files", help="the calculator logs to replay", type=str, nargs="+")
+    parser.add_argument("-l", "--logger", help="logger backend used during the replay (default: background)",
+                        choices=LOGGER_MODES, default="background")
+    parser.add_argument("-r", "--repeat", help="how often every log is replayed (default: 1)", type=int, default=1)
+    parser.add_argument("-o", "--output", help="write the results as json to this file instead of stdout", type=str,
+                        default=None)
+    parser.add_argument("-v", "--verbose", help="show the output of the calculator", action="store_true")
+    args = parser.parse_args()
+
+    results = [replay_log(log_file, args.logger, args.repeat, args.verbose) for log_file in args.log_files]
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Predicts the time of the KLM P operator with Fitts' law instead of a single constant.
+
+The geometry of the calculator buttons is extracted once from the .ui files (by laying out the form without showing
+it) and cached as json in __uicache__ next to the compiled ui modules. From it, the Fitts index of difficulty
+(Shannon formulation, ID = log2(D / W + 1)) for every pair of buttons is precomputed into a matrix, so the pointing
+time of any button sequence is only a lookup in this matrix:
+
+    MT = a + b * ID
+
+The coefficients a and b can be fitted from the hover -> click segments of the recorded logs (see
+klm_timing.hover_to_click_segments()). A fitted a can be negative, so the predicted times are clamped at 0 for easy
+movements (short distances to wide targets).
+
+Usage:
+    python fitts.py calculator.ui klm_p_log.csv
+    python fitts.py calculator.ui klm_p_log.csv -s "1+2=" -s "(3*3+4*4)*15.2="
+"""
+
+import os
+import json
+import argparse
+
+import numpy as np
+
+from ui_loader import UI_DIRECTORY, UI_CACHE_DIRECTORY
+
+
+def _geometry_cache_path(ui_file: str) -> str:
+    file_name = os.path.splitext(os.path.basename(ui_file))[0] + "_geometry.json"
+    return os.path.join(UI_CACHE_DIRECTORY, file_name)
+
+
+def _layout_button_geometry(ui_file: str) -> dict[str, list[int]]:
+    # Qt is only needed if the geometry isn't cached yet
+    from PyQt5 import QtWidgets, QtCore
+    from ui_loader import load_ui
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    form = QtWidgets.QWidget()
+    load_ui(ui_file, form)
+    form.setAttribute(QtCore.Qt.WA_DontShowOnScreen)
+    form.show()
+
+    geometry = {}
+    duplicates = set()
+    for button in form.findChildren(QtWidgets.QPushButton):
+        text = button.text()
+        if not text or text in duplicates:
+            continue
+        if text in geometry:
+            # e.g. the start buttons of the experiment, they can't be told apart in the logs
+            duplicates.add(text)
+            del geometry[text]
+            continue
+        # buttons on a page of a stacked widget are only laid out if their page is shown
+        widget = button
+        while widget is not form:
+            if isinstance(widget.parentWidget(), QtWidgets.QStackedWidget):
+                widget.parentWidget().setCurrentWidget(widget)
+            widget = widget.parentWidget()
+        app.processEvents()
+        position = button.mapTo(form, QtCore.QPoint(0, 0))
+        geometry[text] = [position.x(), position.y(), button.width(), button.height()]
+
+    form.close()
+    form.deleteLater()
+    return geometry
+
+
+def extract_button_geometry(ui_file_name: str, force: bool = False) -> dict[str, list[int]]:
+    """
+    Returns the geometry of all buttons of the given .ui file in the default window size as a dict from the button
+    text (the value logged in the button / argument column) to [x, y, width, height] in pixels. The result is cached
+    and only extracted again if the .ui file changed.
+    """
+    ui_file = ui_file_name if os.path.isabs(ui_file_name) else os.path.join(UI_DIRECTORY, ui_file_name)
+    cache_path = _geometry_cache_path(ui_file)
+    if not force and os.path.isfile(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(ui_file):
+        with open(cache_path) as cache_file:
+            return json.load(cache_file)
+
+    geometry = _layout_button_geometry(ui_file)
+    try:
+        os.makedirs(UI_CACHE_DIRECTORY, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as cache_file:
+            json.dump(geometry, cache_file, indent=1)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass  # the cache is optional
+    return geometry
+
+
+def index_of_difficulty(start_points: np.ndarray, target_centers: np.ndarray, target_sizes: np.ndarray) -> np.ndarray:
+    """
+    Calculates the Fitts index of difficulty (in bits) for pointing movements from the start points to rectangular
+    targets. The target width is the width of the rectangle along the direction of the movement.
+
+    :param start_points: (n x 2) array with the start positions
+    :param target_centers: (n x 2) array with the centers of the targets
+    :param target_sizes: (n x 2) array with the width and height of the targets
+    :return: n indices of difficulty (0 for movements without a distance)
+    """
+    offsets = np.asarray(target_centers, dtype=np.float64) - np.asarray(start_points, dtype=np.float64)
+    distances = np.hypot(offsets[..., 0], offsets[..., 1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        directions = np.abs(offsets) / distances[..., np.newaxis]
+        widths = np.min(np.asarray(target_sizes, dtype=np.float64) / directions, axis=-1)
+        ids = np.log2(distances / widths + 1)
+    return np.where(distances > 0, ids, 0.0)
+
+
+def fit_fitts_coefficients(ids: np.ndarray, movement_times: np.ndarray) -> tuple[float, float]:
+    """
+    Fits the coefficients of MT = a + b * ID with a least squares regression.
+
+    :return: the intercept a in seconds and the slope b in seconds per bit
+    """
+    ids = np.asarray(ids, dtype=np.float64)
+    if len(ids) < 2 or np.ptp(ids) == 0:
+        raise ValueError("The fit needs at least two pointing movements with different indices of difficulty!")
+    design_matrix = np.column_stack((np.ones_like(ids), ids))
+    (a, b), *_ = np.linalg.lstsq(design_matrix, np.asarray(movement_times, dtype=np.float64), rcond=None)
+    return float(a), float(b)
+
+
+class FittsModel:
+    """
+    Predicts pointing times between the buttons of a calculator layout. The index of difficulty for every pair of
+    buttons is calculated once in the constructor; id_matrix[i, j] is the ID of a movement from button i to button j.
+    The extra last row is used for the first movement of a sequence whose start is unknown and contains the mean ID
+    from all other buttons to the target.
+    """
+
+    def __init__(self, button_geometry: dict[str, list[int]], a: float = 0.0, b: float = 0.0):
+        self.buttons = tuple(button_geometry)
+        self.button_indices = {button: index for index, button in enumerate(self.buttons)}
+        geometry = np.array([button_geometry[button] for button in self.buttons], dtype=np.float64).reshape(-1, 4)
+        self.sizes = geometry[:, 2:]
+        self.centers = geometry[:, :2] + self.sizes / 2
+        self.a = a
+        self.b = b
+        # lookup table for the buttons with a single character, so strings can be encoded without a python loop
+        self.__character_indices = np.full(256, -1, dtype=np.intp)
+        for button, index in self.button_indices.items():
+            if len(button) == 1 and ord(button) < 256:
+                self.__character_indices[ord(button)] = index
+
+        count = len(self.buttons)
+        start_points = np.repeat(self.centers, count, axis=0)
+        target_centers = np.tile(self.centers, (count, 1))
+        target_sizes = np.tile(self.sizes, (count, 1))
+        ids = index_of_difficulty(start_points, target_centers, target_sizes).reshape(count, count)
+        unknown_start_ids = ids.sum(axis=0) / max(count - 1, 1)  # the diagonal is 0
+        self.id_matrix = np.vstack((ids, unknown_start_ids))
+        self.unknown_start = count
+
+    @classmethod
+    def from_ui_file(cls, ui_file_name: str, a: float = 0.0, b: float = 0.0) -> "FittsModel":
+        return cls(extract_button_geometry(ui_file_name), a, b)
+
+    def encode(self, buttons) -> np.ndarray:
+        """
+        Converts a sequence of button texts (e.g. a string like "1+2=" or a list like ["Clear", "1"]) to indices.
+        """
+        if isinstance(buttons, str) and buttons.isascii():
+            indices = self.__character_indices[np.frombuffer(buttons.encode("ascii"), dtype=np.uint8)]
+            if np.all(indices >= 0):
+                return indices
+        try:
+            return np.fromiter((self.button_indices[button] for button in buttons), dtype=np.intp)
+        except KeyError as error:
+            raise ValueError(f"Unknown button {error.args[0]!r}!") from None
+
+    def fit(self, log, min_hovers: int = 3) -> "FittsModel":
+        """
+        Fits a and b to the hover -> click segments of a log with pointing movements (e.g. klm_p_log.csv). Segments
+        between unknown buttons or that start and end at the same button are skipped.
+
+        :return: the model itself
+        """
+        from klm_timing import hover_to_click_segments
+
+        sources, targets, durations = hover_to_click_segments(log, min_hovers)
+        valid = np.array([source in self.button_indices and target in self.button_indices and source != target
+                          for source, target in zip(sources, targets)], dtype=bool)
+        ids = self.id_matrix[self.encode(sources[valid]), self.encode(targets[valid])]
+        self.a, self.b = fit_fitts_coefficients(ids, durations[valid])
+        return self
+
+    def sequence_ids(self, buttons, start=None) -> np.ndarray:
+        """
+        Returns the index of difficulty of every movement in the button sequence: the first movement goes from start
+        (a button or None if it is unknown) to the first button, every following one from the previous button.
+        """
+        indices = self.encode(buttons)
+        previous = np.empty_like(indices)
+        previous[:1] = self.unknown_start if start is None else self.button_indices[start]
+        previous[1:] = indices[:-1]
+        return self.id_matrix[previous, indices]
+
+    def pointing_times(self, buttons, start=None) -> np.ndarray:
+        """
+        Returns the predicted time in seconds of every pointing movement in the button sequence (see sequence_ids()).
+        """
+        return self.movement_times(self.sequence_ids(buttons, start))
+
+    def movement_times(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Returns the predicted times in seconds for the given indices of difficulty (e.g. id_matrix), never negative.
+        """
+        return np.maximum(self.a + self.b * ids, 0.0)
+
+    def score_sequences(self, sequences) -> np.ndarray:
+        """
+        Calculates the total pointing time of many button sequences at once. All sequences are concatenated, so the
+        IDs are looked up with one indexing operation and summed per sequence with np.bincount().
+
+        :param sequences: button sequences, each one starting at an unknown position
+        :return: the total pointing time in seconds for each sequence
+        """
+        sequences = list(sequences)
+        lengths = np.fromiter(map(len, sequences), dtype=np.intp, count=len(sequences))
+        if lengths.sum() == 0:
+            return np.zeros(len(sequences), dtype=np.float64)
+        if all(isinstance(sequence, str) for sequence in sequences):
+            indices = self.encode("".join(sequences))
+        else:
+            indices = np.concatenate([self.encode(sequence) for sequence in sequences])
+        offsets = np.cumsum(lengths) - lengths
+
+        previous = np.empty_like(indices)
+        previous[1:] = indices[:-1]
+        previous[offsets[lengths > 0]] = self.unknown_start
+        times = self.movement_times(self.id_matrix[previous, indices])
+        sequence_numbers = np.repeat(np.arange(len(sequences)), lengths)
+        return np.bincount(sequence_numbers, weights=times, minlength=len(sequences))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fits Fitts' law to the pointing movements in a calculator log and "
+                                                 "predicts the pointing times of button sequences.")
+    parser.add_argument("ui_file", help="the .ui file of the calculator that was used for the log", type=str)
+    parser.add_argument("p_log", help="log of the pointing task", type=str)
+    parser.add_argument("-s", "--sequence", help="a button sequence to predict, e.g. \"1+2=\" (can be repeated)",
+                        type=str, action="append", default=[])
+    args = parser.parse_args()
+
+    from calculator_log_format import read_log
+
+    model = FittsModel.from_ui_file(args.ui_file).fit(read_log(args.p_log))
+    print(f"MT = {model.a:.3f} s + {model.b:.3f} s/bit * ID")
+    for sequence in args.sequence:
+        times = model.pointing_times(sequence)
+        print(f"{sequence}: {len(times)}P = {times.sum():.3f} s ({', '.join(f'{time:.3f}' for time in times)})")
+
+
+if __name__ == '__main__':
+    main()
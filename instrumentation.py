@@ -0,0 +1,189 @@
+"""
+Low-overhead instrumentation of the calculator's hot paths (input handlers, event filter, logger).
+
+Functions decorated with @instrument record their duration (time.perf_counter_ns) into a histogram with power-of-two
+buckets. Recording is switched on and off at runtime with enable() / disable(); while it is disabled the decorator
+only costs one global flag check per call. The histograms can be dumped as json or in the Prometheus text format.
+
+Setting the environment variable CALCULATOR_INSTRUMENTATION to a file name (e.g. metrics.json or metrics.prom) and
+calling setup_from_environment() enables the instrumentation, dumps the histograms to that file at exit and on SIGUSR1
+and toggles the recording on SIGUSR2.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import signal
+import functools
+
+
+INSTRUMENTATION_ENV_VARIABLE = "CALCULATOR_INSTRUMENTATION"
+PROMETHEUS_METRIC_NAME = "calculator_handler_duration_seconds"
+
+_BUCKET_COUNT = 64  # bucket i counts the durations d with 2^(i-1) <= d < 2^i nanoseconds
+
+_enabled = False
+_histograms = {}
+
+
+class Histogram:
+    """
+    Counts durations (in nanoseconds) in power-of-two buckets, so recording a value is just a bit_length() and a few
+    additions.
+    """
+    __slots__ = ("counts", "count", "total", "minimum", "maximum")
+
+    def __init__(self):
+        self.counts = [0] * _BUCKET_COUNT
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = 0
+
+    def record(self, duration_ns: int) -> None:
+        self.counts[min(duration_ns.bit_length(), _BUCKET_COUNT - 1)] += 1
+        self.count += 1
+        self.total += duration_ns
+        if self.minimum is None or duration_ns < self.minimum:
+            self.minimum = duration_ns
+        if duration_ns > self.maximum:
+            self.maximum = duration_ns
+
+    def quantile(self, q: float) -> int:
+        """
+        Returns an upper bound for the given quantile (the upper limit of the bucket that contains it) in nanoseconds.
+        """
+        if self.count == 0:
+            return 0
+        rank = q * self.count
+        cumulative_count = 0
+        for bucket, bucket_count in enumerate(self.counts):
+            cumulative_count += bucket_count
+            if cumulative_count >= rank:
+                return min(1 << bucket, self.maximum)
+        return self.maximum
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum_ns": self.total,
+            "min_ns": self.minimum or 0,
+            "max_ns": self.maximum,
+            "mean_ns": self.total / self.count if self.count else 0,
+            "p50_ns": self.quantile(0.5),
+            "p95_ns": self.quantile(0.95),
+            "p99_ns": self.quantile(0.99),
+            # upper bucket limit in ns -> count (only the used buckets)
+            "buckets": {str(1 << bucket): bucket_count for bucket, bucket_count in enumerate(self.counts)
+                        if bucket_count},
+        }
+
+
+def enable() -> None:
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    for histogram in _histograms.values():
+        histogram.__init__()
+
+
+def get_histogram(name: str) -> Histogram:
+    if name not in _histograms:
+        _histograms[name] = Histogram()
+    return _histograms[name]
+
+
+def instrument(function=None, *, name: str = None):
+    """
+    Decorator that records the duration of every call of the function into the histogram with the given name
+    (default: <module>.<qualified function name>). Can be used as @instrument or @instrument(name="...").
+    """
+    if function is None:
+        return functools.partial(instrument, name=name)
+
+    histogram = get_histogram(name or f"{function.__module__}.{function.__qualname__}")
+    perf_counter_ns = time.perf_counter_ns
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+        start = perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            histogram.record(perf_counter_ns() - start)
+
+    return wrapper
+
+
+def to_dict() -> dict:
+    return {name: histogram.to_dict() for name, histogram in sorted(_histograms.items()) if histogram.count}
+
+
+def to_json() -> str:
+    return json.dumps(to_dict(), indent=2)
+
+
+def to_prometheus() -> str:
+    """
+    Returns all histograms in the Prometheus text exposition format (durations in seconds).
+    """
+    lines = [f"# HELP {PROMETHEUS_METRIC_NAME} Duration of the instrumented calculator handlers.",
+             f"# TYPE {PROMETHEUS_METRIC_NAME} histogram"]
+    for name, histogram in sorted(_histograms.items()):
+        if not histogram.count:
+            continue
+        label = name.replace("\\", "\\\\").replace('"', '\\"')
+        cumulative_count = 0
+        used_buckets = [bucket for bucket, bucket_count in enumerate(histogram.counts) if bucket_count]
+        # the (empty) buckets below the first used one are left out
+        for bucket in range(used_buckets[0], used_buckets[-1] + 1):
+            cumulative_count += histogram.counts[bucket]
+            lines.append(f'{PROMETHEUS_METRIC_NAME}_bucket{{handler="{label}",le="{(1 << bucket) / 1e9:.9g}"}} '
+                         f'{cumulative_count}')
+        lines.append(f'{PROMETHEUS_METRIC_NAME}_bucket{{handler="{label}",le="+Inf"}} {histogram.count}')
+        lines.append(f'{PROMETHEUS_METRIC_NAME}_sum{{handler="{label}"}} {histogram.total / 1e9:.9g}')
+        lines.append(f'{PROMETHEUS_METRIC_NAME}_count{{handler="{label}"}} {histogram.count}')
+    return "\n".join(lines) + "\n"
+
+
+def dump(file_name: str = None) -> None:
+    """
+    Writes the histograms to the given file (Prometheus format for .prom / .txt files, json otherwise) or as json to
+    stderr if no file name is given.
+    """
+    if file_name is None:
+        sys.stderr.write(to_json() + "\n")
+        return
+    text = to_prometheus() if file_name.endswith((".prom", ".txt")) else to_json()
+    with open(file_name, "w") as metrics_file:
+        metrics_file.write(text)
+
+
+def setup_from_environment() -> None:
+    """
+    Enables the instrumentation if CALCULATOR_INSTRUMENTATION is set (see module docstring). The signal handlers run
+    as soon as the python interpreter gets control again, i.e. with the next handled Qt event.
+    """
+    file_name = os.environ.get(INSTRUMENTATION_ENV_VARIABLE)
+    if not file_name:
+        return
+    enable()
+    atexit.register(dump, file_name)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signal_number, frame: dump(file_name))
+        signal.signal(signal.SIGUSR2, lambda signal_number, frame: disable() if _enabled else enable())
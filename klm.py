@@ -7,7 +7,18 @@ This python program was implemented by Michael Meckl.
 
 import sys
 import os
+import io
+import csv
+import glob
+import json
+import hashlib
 import argparse
+import functools
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
+
+import numpy as np
 
 
 """
@@ -34,62 +45,135 @@ KLM_CUSTOM_VALUES = {
 }
 
 
-def parse_klm_file(file_name: str) -> str:
+def parse_klm_file(file_name: str, cache: "CompiledScriptCache" = None) -> str:
     """
     Parses the given file and returns all klm operators in it.
 
     :param file_name: the path to the klm input file
+    :param cache: an optional cache for compiled scripts, so unchanged files don't have to be parsed again
     :return: a string containing all klm operators in the order they were found within the file
     """
 
-    # check if the file exists
-    if os.path.isfile(file_name):
-        with open(file_name) as setup_file:
-            # read in content
-            content = setup_file.read()
-
-            # make text uppercase so everything will match the dict values no matter in which case it was entered
-            content = content.upper()
-
-            # split on line break (this removes the line breaks too in contrast to readlines()) and remove all comments
-            operators = []
-            for line in content.splitlines():
-                # find the index in the string when the comment starts
-                comment_index = line.find("#")
-                # and remove everything from this index onwards as we don't need it
-                line_without_comment = line[:line.find("#")] if comment_index != -1 else line
-                if line_without_comment != "":
-                    # save line without the trailing whitespaces if there were actual operators besides the comment
-                    operators.append(line_without_comment.rstrip())
-
-            # operators = [line[:line.find("#")].rstrip() if line.find("#") != -1 else line.rstrip()
-            #              for line in content.splitlines()]
-
-            operator_string = "".join(operators).replace(" ", "")  # join all operators to one string without spaces
-            print(f"Input operators were: {operator_string}")
-            return operator_string
-    else:
-        sys.stderr.write("Given setup file does not exist!")
-        exit(1)
+    return load_klm_script(file_name, cache).operators
 
 
-def calculate_completion_time(operators: str, klm_value_dict: dict[str, float]) -> int:
+def iter_klm_operators(file_name: str) -> Iterator[str]:
     """
-    Calculates a prediction for the task completion time for the given operators based on the values specified in the
-    klm_value_dict.
+    Reads the given klm file line by line and yields the operators (and count digits) in it one character at a time,
+    without building a string of the whole file. Comments and spaces are skipped and everything is made uppercase so
+    it will match the dict values no matter in which case it was entered.
 
-    :param operators: a string containing all operators
-    :param klm_value_dict: a python dictionary containing time values (in seconds) for the klm operators
-    :return: the calculated time for all operators in seconds
+    :param file_name: the path to the klm input file
     """
 
-    task_completion_time = 0  # in seconds
+    with open(file_name) as setup_file:
+        yield from iter_klm_line_operators(setup_file)
+
+
+def iter_klm_line_operators(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Like iter_klm_operators(), but for klm lines that were already read (e.g. to hash the content first).
+    """
+
+    for line in lines:
+        # find the index in the string when the comment starts
+        comment_index = line.find("#")
+        # and remove everything from this index onwards as we don't need it
+        line_without_comment = line[:comment_index] if comment_index != -1 else line
+        # remove the line break and trailing whitespaces as well as all spaces between the operators
+        yield from line_without_comment.rstrip().replace(" ", "").upper()
+
+
+# version of the json parameter files written by klm_calibration.py
+KLM_PARAMETER_FILE_VERSION = 1
+
+
+def load_klm_values(parameter_file: str) -> dict[str, float]:
+    """
+    Loads calibrated klm values from a parameter file written by klm_calibration.py, so they can be used instead of
+    KLM_CUSTOM_VALUES.
+    """
+
+    with open(parameter_file) as json_file:
+        parameters = json.load(json_file)
+    if parameters.get("version") != KLM_PARAMETER_FILE_VERSION:
+        raise ValueError(f"{parameter_file} has an unsupported version ({parameters.get('version')})!")
+    return {operator: float(value) for operator, value in parameters["values"].items()}
+
+
+# the order of the operators in the compiled operator-count vectors
+KLM_OPERATORS = tuple(KLM_DEFAULT_VALUES)
+
+
+def compile_operators(operators: str, operator_names: tuple[str, ...] = KLM_OPERATORS) -> np.ndarray:
+    """
+    Compiles the given operator string into an operator-count vector, i.e. "16P32B" becomes 16 for the P operator and
+    32 for the B operator. The operator string only has to be walked once, after that the completion time for any klm
+    values can be calculated with a dot product (see klm_value_matrix()).
+
+    :param operators: a string containing all operators (e.g. the output of parse_klm_file())
+    :param operator_names: the valid operators; the order determines the order of the counts in the vector
+    :return: a float vector containing the count of each operator in operator_names
+    """
+
+    if not isinstance(operators, str):
+        operators = "".join(operators)  # e.g. the operators of iter_klm_operators()
+    operator_indices = {operator: index for index, operator in enumerate(operator_names)}
+    try:
+        codes = np.frombuffer(operators.encode("ascii"), dtype=np.uint8)
+    except UnicodeEncodeError:
+        return _compile_operators_by_character(operators, operator_indices)
+
+    # look-up table from the character code to the operator index (digit_index for the digits, -1 for the rest)
+    digit_index = len(operator_names)
+    code_indices = np.full(128, -1, dtype=np.intp)
+    for operator, index in operator_indices.items():
+        if len(operator) == 1 and operator.isascii():
+            code_indices[ord(operator)] = index
+    code_indices[ord("0"):ord("9") + 1] = digit_index
+    indices = code_indices[codes]
+
+    invalid_positions = np.flatnonzero(indices == -1)
+    if invalid_positions.size:
+        for position in invalid_positions:
+            sys.stderr.write(f"Given operator {operators[position]} is neither a valid klm operator nor a digit!")
+        # the digits before and after an invalid character still form one count
+        codes = np.delete(codes, invalid_positions)
+        indices = np.delete(indices, invalid_positions)
+
+    counts = np.bincount(indices, minlength=digit_index + 1)
+    operator_counts = counts[:digit_index].astype(np.float64)
+    if counts[digit_index] == 0:
+        return operator_counts
+
+    # every run of digits is the count of the operator after it (e.g. "16P"), that operator is already counted once
+    digit_positions = np.flatnonzero(indices == digit_index)
+    is_run_start = np.ones(digit_positions.size, dtype=bool)
+    is_run_start[1:] = np.diff(digit_positions) != 1
+    run_starts = np.flatnonzero(is_run_start)
+    run_ends = np.append(run_starts[1:], digit_positions.size) - 1
+    exponents = run_ends[np.cumsum(is_run_start) - 1] - np.arange(digit_positions.size)
+    with np.errstate(over="ignore", invalid="ignore"):
+        numbers = np.add.reduceat((codes[digit_positions] - ord("0")) * 10.0 ** exponents, run_starts)
+    for run in np.flatnonzero(run_ends - run_starts >= 15):  # not exact as a float sum anymore
+        numbers[run] = int(codes[digit_positions[run_starts[run]]:digit_positions[run_ends[run]] + 1].tobytes())
+    next_positions = digit_positions[run_ends] + 1
+    has_operator = next_positions < indices.size  # digits at the end don't count anything
+    np.add.at(operator_counts, indices[next_positions[has_operator]], numbers[has_operator] - 1)
+    return operator_counts
+
+
+def _compile_operators_by_character(operators: str, operator_indices: dict[str, int]) -> np.ndarray:
+    """
+    compile_operators() for operator strings with non-ascii characters (e.g. other digits than 0-9).
+    """
+    operator_counts = [0] * len(operator_indices)
     tmp_number = ""  # temp variable for storing the count before some operators
 
     for operator in operators:
-        if klm_value_dict.get(operator, -1) != -1:  # check if the operator is a valid klm operator
-            operator_time = klm_value_dict.get(operator)
-            task_completion_time += operator_time if tmp_number == "" else int(tmp_number) * operator_time
+        operator_index = operator_indices.get(operator, -1)
+        if operator_index != -1:  # check if the operator is a valid klm operator
+            operator_counts[operator_index] += 1 if tmp_number == "" else int(tmp_number)
             tmp_number = ""  # reset temp variable
 
         elif operator.isdigit():
@@ -98,35 +182,356 @@ def calculate_completion_time(operators: str, klm_value_dict: dict[str, float])
         else:
             sys.stderr.write(f"Given operator {operator} is neither a valid klm operator nor a digit!")
 
-    return task_completion_time
+    return np.array(operator_counts, dtype=np.float64)
+
+
+def compile_klm_scripts(operator_strings, operator_names: tuple[str, ...] = KLM_OPERATORS) -> np.ndarray:
+    """
+    Compiles several operator strings at once.
+
+    :return: a (scripts x operators) matrix with one operator-count vector per row
+    """
+    operator_strings = list(operator_strings)
+    script_matrix = np.zeros((len(operator_strings), len(operator_names)), dtype=np.float64)
+    for row, operators in enumerate(operator_strings):
+        script_matrix[row] = compile_operators(operators, operator_names)
+    return script_matrix
+
+
+def klm_value_matrix(klm_value_dicts, operator_names: tuple[str, ...] = KLM_OPERATORS) -> np.ndarray:
+    """
+    Converts several klm value dicts (e.g. KLM_DEFAULT_VALUES and KLM_CUSTOM_VALUES or thousands of candidate
+    parameter sets for a sensitivity analysis) to an (operators x parameter sets) matrix. Operators missing in a dict
+    get a time of 0 seconds.
+    """
+    klm_value_dicts = list(klm_value_dicts)
+    value_matrix = np.zeros((len(operator_names), len(klm_value_dicts)), dtype=np.float64)
+    for column, klm_value_dict in enumerate(klm_value_dicts):
+        value_matrix[:, column] = [klm_value_dict.get(operator, 0.0) for operator in operator_names]
+    return value_matrix
+
+
+def calculate_completion_times(script_matrix: np.ndarray, value_matrix: np.ndarray) -> np.ndarray:
+    """
+    Calculates the task completion times for many compiled operator scripts and many klm parameter sets in one
+    matrix product.
+
+    :param script_matrix: a (scripts x operators) matrix, see compile_klm_scripts()
+    :param value_matrix: an (operators x parameter sets) matrix, see klm_value_matrix()
+    :return: a (scripts x parameter sets) matrix with the completion times in seconds
+    """
+    return script_matrix @ value_matrix
+
 
+def calculate_completion_time(operators: str, klm_value_dict: dict[str, float], pointing_targets=None,
+                              fitts_model=None) -> int:
+    """
+    Calculates a prediction for the task completion time for the given operators based on the values specified in the
+    klm_value_dict.
+
+    :param operators: a string containing all operators
+    :param klm_value_dict: a python dictionary containing time values (in seconds) for the klm operators
+    :param pointing_targets: optional sequence of the buttons the P operators point at (e.g. "1+2="); if it is given
+                             together with a fitts_model (see fitts.FittsModel), every P operator is scored with the
+                             Fitts' law prediction for its target instead of the constant P value
+    :param fitts_model: the model that predicts the pointing times for the pointing_targets
+    :return: the calculated time for all operators in seconds
+    """
+
+    operator_names = tuple(klm_value_dict)
+    operator_counts = compile_operators(operators, operator_names)
+    if pointing_targets is None or fitts_model is None:
+        return float(operator_counts @ klm_value_matrix([klm_value_dict], operator_names)[:, 0])
+
+    pointing_times = fitts_model.pointing_times(pointing_targets)
+    p_index = operator_names.index("P") if "P" in operator_names else None
+    p_count = 0 if p_index is None else int(operator_counts[p_index])
+    if len(pointing_times) != p_count:
+        raise ValueError(f"Got {len(pointing_times)} pointing targets for {p_count} P operators!")
+    if p_index is not None:
+        operator_counts[p_index] = 0  # the P operators are scored with Fitts' law instead
+    return float(operator_counts @ klm_value_matrix([klm_value_dict], operator_names)[:, 0] + pointing_times.sum())
+
+
+class CompiledScript:
+    """
+    A parsed klm file: the normalized operator string and its operator-count vector (see compile_operators()).
+    """
+    __slots__ = ("operators", "operator_counts")
 
-def calculate_klm(klm_file: str) -> tuple[int, int]:
+    def __init__(self, operators: str, operator_counts: np.ndarray):
+        self.operators = operators
+        self.operator_counts = operator_counts
+
+
+# has to be increased whenever the parsing changes, so old cache entries aren't used anymore
+KLM_PARSER_VERSION = 1
+
+
+class CompiledScriptCache:
+    """
+    Caches compiled klm files by the hash of their content (together with the parser version and the operators).
+    Entries are kept in memory with LRU eviction and are additionally stored as small json files in cache_dir (if
+    given), so later runs and other processes don't have to parse unchanged files again.
+    """
+
+    def __init__(self, cache_dir: str = None, max_entries: int = 1024):
+        """
+        :param cache_dir: directory for the persistent cache entries (only in-memory caching if None)
+        :param max_entries: max. number of compiled scripts kept in memory
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _cache_key(content: bytes) -> str:
+        key_hash = hashlib.sha256(f"{KLM_PARSER_VERSION}:{''.join(KLM_OPERATORS)}:".encode("utf-8"))
+        key_hash.update(content)
+        return key_hash.hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, file_name: str) -> CompiledScript:
+        """
+        Returns the compiled script for the given klm file, parsing it only if its content isn't cached yet.
+        """
+        # the file is read only once, the same bytes are hashed and (on a miss) parsed
+        with open(file_name, "rb") as klm_file:
+            content = klm_file.read()
+        key = self._cache_key(content)
+
+        compiled_script = self.__entries.get(key)
+        if compiled_script is not None:
+            self.hits += 1
+            self.__entries.move_to_end(key)
+            return compiled_script
+
+        compiled_script = self.__load_entry(key)
+        if compiled_script is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            # decoded like open() in iter_klm_operators() does it (default encoding, universal newlines)
+            lines = io.TextIOWrapper(io.BytesIO(content))
+            operators = "".join(iter_klm_line_operators(lines))
+            compiled_script = CompiledScript(operators, compile_operators(operators))
+            self.__store_entry(key, compiled_script)
+
+        self.__entries[key] = compiled_script
+        if len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)  # remove the least recently used entry
+        return compiled_script
+
+    def __load_entry(self, key: str):
+        if not self.cache_dir or not os.path.isfile(self._entry_path(key)):
+            return None
+        try:
+            with open(self._entry_path(key)) as entry_file:
+                entry = json.load(entry_file)
+            return CompiledScript(entry["operators"], np.array(entry["operator_counts"], dtype=np.float64))
+        except (OSError, ValueError, KeyError):
+            return None  # a broken entry is simply compiled again
+
+    def __store_entry(self, key: str, compiled_script: CompiledScript) -> None:
+        if not self.cache_dir:
+            return
+        # write to a temp file first and rename it, so other processes never read a half written entry
+        tmp_path = f"{self._entry_path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as entry_file:
+            json.dump({"parser_version": KLM_PARSER_VERSION, "operators": compiled_script.operators,
+                       "operator_counts": compiled_script.operator_counts.tolist()}, entry_file)
+        os.replace(tmp_path, self._entry_path(key))
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "entries": len(self.__entries)}
+
+    def clear(self) -> None:
+        self.__entries.clear()
+        self.hits = self.disk_hits = self.misses = 0
+
+
+def load_klm_script(file_name: str, cache: CompiledScriptCache = None) -> CompiledScript:
+    """
+    Parses and compiles the given klm file (or takes it from the cache).
+
+    :param file_name: the path to the klm input file
+    :param cache: an optional cache for compiled scripts
+    """
+
+    # check if the file exists
+    if os.path.isfile(file_name):
+        if cache is not None:
+            compiled_script = cache.get(file_name)
+        else:
+            operators = "".join(iter_klm_operators(file_name))
+            compiled_script = CompiledScript(operators, compile_operators(operators))
+        print(f"Input operators were: {compiled_script.operators}")
+        return compiled_script
+    else:
+        sys.stderr.write("Given setup file does not exist!")
+        exit(1)
+
+
+def calculate_klm(klm_file: str, cache: CompiledScriptCache = None,
+                  custom_values: dict[str, float] = None) -> tuple[int, int]:
     # parse input file with the klm operators
-    parsed_operators = parse_klm_file(klm_file)
+    compiled_script = load_klm_script(klm_file, cache)
+    custom_values = custom_values or KLM_CUSTOM_VALUES
 
-    # calculate task completion times for default and custom klm values
-    predicted_time_custom = calculate_completion_time(operators=parsed_operators, klm_value_dict=KLM_CUSTOM_VALUES)
+    # calculate task completion times for default and custom klm values (the operators only have to be compiled once)
+    predicted_time_default, predicted_time_custom = (
+        float(time) for time in compiled_script.operator_counts @ klm_value_matrix([KLM_DEFAULT_VALUES,
+                                                                                     custom_values]))
     print(f"Predicted task completion time for the given operators using custom klm values: "
           f"{predicted_time_custom:0.3f} seconds.")
-    predicted_time_default = calculate_completion_time(operators=parsed_operators, klm_value_dict=KLM_DEFAULT_VALUES)
     print(f"Predicted task completion time for the given operators using default klm values: "
           f"{predicted_time_default:0.3f} seconds.")
     return predicted_time_default, predicted_time_custom
 
 
+# one cache per worker process and cache directory for the batch mode
+_worker_caches = {}
+
+
+def _get_worker_cache(cache_dir: str) -> CompiledScriptCache:
+    if cache_dir not in _worker_caches:
+        _worker_caches[cache_dir] = CompiledScriptCache(cache_dir)
+    return _worker_caches[cache_dir]
+
+
+def evaluate_klm_file(file_name: str, cache_dir: str = None, custom_values: dict[str, float] = None) -> dict:
+    """
+    Calculates the default and custom task completion time for a single klm file for the batch mode. Errors are
+    returned in the result instead of stopping the program. custom_values replaces KLM_CUSTOM_VALUES if it is given.
+
+    :return: a dict with the file name, the operator count, both predicted times and an error message (or "")
+    """
+
+    result = {"file": file_name, "operators": 0, "time_default_in_s": None, "time_custom_in_s": None, "error": ""}
+    if not os.path.isfile(file_name):
+        result["error"] = "Given setup file does not exist!"
+        return result
+    try:
+        if cache_dir:
+            operator_counts = _get_worker_cache(cache_dir).get(file_name).operator_counts
+        else:
+            operator_counts = compile_operators(iter_klm_operators(file_name))
+    except (OSError, UnicodeDecodeError, ValueError) as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+        return result
+
+    custom_values = custom_values or KLM_CUSTOM_VALUES
+    predicted_time_default, predicted_time_custom = operator_counts @ klm_value_matrix([KLM_DEFAULT_VALUES,
+                                                                                        custom_values])
+    result["operators"] = int(operator_counts.sum())
+    result["time_default_in_s"] = float(predicted_time_default)
+    result["time_custom_in_s"] = float(predicted_time_custom)
+    return result
+
+
+def _is_glob_pattern(path: str) -> bool:
+    """
+    Returns whether the given path contains glob wildcards ("*", "?" or "[").
+    """
+    return any(character in path for character in "*?[")
+
+
+def find_klm_files(paths: list[str], pattern: str = "*.txt") -> list[str]:
+    """
+    Expands the given command line paths: directories are searched recursively for files matching the pattern and
+    glob expressions are resolved. Everything else is kept as it is, so missing files show up in the results.
+    """
+
+    klm_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            klm_files.extend(sorted(glob.glob(os.path.join(path, "**", pattern), recursive=True)))
+        elif _is_glob_pattern(path):
+            klm_files.extend(sorted(glob.glob(path, recursive=True)))
+        else:
+            klm_files.append(path)
+    return klm_files
+
+
+def calculate_klm_batch(klm_files: list[str], workers: int = None, cache_dir: str = None,
+                        custom_values: dict[str, float] = None) -> list[dict]:
+    """
+    Evaluates many klm files in a process pool. The results are returned in the same order as the given files.
+
+    :param klm_files: the paths of the klm files
+    :param workers: the number of worker processes (defaults to the number of cores)
+    :param cache_dir: optional directory of a persistent CompiledScriptCache shared by all workers
+    :param custom_values: klm values used instead of KLM_CUSTOM_VALUES (e.g. from load_klm_values())
+    """
+
+    evaluate = functools.partial(evaluate_klm_file, cache_dir=cache_dir, custom_values=custom_values)
+    if len(klm_files) <= 1 or workers == 1:
+        return [evaluate(klm_file) for klm_file in klm_files]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # send the files in chunks so thousands of small files don't cause thousands of round trips
+        chunk_size = max(1, len(klm_files) // (4 * (workers or os.cpu_count() or 1)))
+        return list(executor.map(evaluate, klm_files, chunksize=chunk_size))
+
+
+def write_klm_results(results: list[dict], output_file=None) -> None:
+    """
+    Writes the batch results as csv (or json if the output file ends with .json) to the given file or to stdout.
+    """
+
+    output = open(output_file, "w", newline="") if output_file else sys.stdout
+    try:
+        if output_file and output_file.lower().endswith(".json"):
+            json.dump(results, output, indent=2)
+        else:
+            writer = csv.DictWriter(output, fieldnames=["file", "operators", "time_default_in_s", "time_custom_in_s",
+                                                        "error"], lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(results)
+    finally:
+        if output_file:
+            output.close()
+
+
 def main():
     # parse command line input and print out some helpful information
     parser = argparse.ArgumentParser(description="A small program to parse klm operators given as a file and output"
                                                  " the calculated task completion time for these operators.")
-    parser.add_argument("klm_file", help="A file containing the klm operators (can contain python comments (#) too)",
-                        type=str)
+    parser.add_argument("klm_file", help="A file containing the klm operators (can contain python comments (#) too). "
+                                         "Several files, directories or glob patterns start the batch mode.",
+                        type=str, nargs="+")
+    parser.add_argument("-o", "--output", help="batch mode: write the results to this csv or json file instead of "
+                                               "stdout", type=str, default=None)
+    parser.add_argument("-p", "--pattern", help="batch mode: file pattern used when searching directories "
+                                                "(default: *.txt)", type=str, default="*.txt")
+    parser.add_argument("-j", "--workers", help="batch mode: number of worker processes (default: number of cores)",
+                        type=int, default=None)
+    parser.add_argument("--cache-dir", help="directory for caching compiled klm files between runs", type=str,
+                        default=None)
+    parser.add_argument("--klm-values", help="use the calibrated values from this parameter file (see "
+                                             "klm_calibration.py) instead of the hardcoded custom values", type=str,
+                        default=None)
     # parser.add_argument("-c", "--use-custom", help="use custom values for the klm operators instead of the default",
     #                     action="store_true")  # store_true sets the value to True if specified and to False if not
     args = parser.parse_args()
-    input_file = args.klm_file
+    input_files = args.klm_file
+    custom_values = load_klm_values(args.klm_values) if args.klm_values else None
+
+    batch_mode = (len(input_files) > 1 or args.output is not None or os.path.isdir(input_files[0])
+                  or _is_glob_pattern(input_files[0]))
+    if not batch_mode:
+        calculate_klm(input_files[0], CompiledScriptCache(args.cache_dir) if args.cache_dir else None, custom_values)
+        return
 
-    calculate_klm(input_file)
+    results = calculate_klm_batch(find_klm_files(input_files, args.pattern), workers=args.workers,
+                                  cache_dir=args.cache_dir, custom_values=custom_values)
+    write_klm_results(results, args.output)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Calibrates the custom klm operator values from the operator logs with confidence intervals.
+
+The intervals of every operator are extracted from its log (see klm_timing.py) and resampled with a bootstrap: each
+replicate draws as many intervals as were measured (with replacement) and takes their median. All replicates of a
+chunk are drawn at once as one index matrix, and the chunks are distributed over a process pool, so 10000+ replicates
+take only a few seconds. The replicate medians are then propagated through the task scripts (every replicate is one
+column of the klm value matrix, see klm.calculate_completion_times()), which gives confidence intervals for the
+predicted task completion times as well.
+
+The results are written to a versioned json parameter file that klm.py can use instead of KLM_CUSTOM_VALUES
+(python klm.py task.txt --klm-values klm_values.json).
+
+Usage:
+    python klm_calibration.py klm_k_log.csv klm_p_log.csv klm_b_log.csv klm_h_log.csv -t klm_tasks -o klm_values.json
+"""
+
+import os
+import json
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from klm import (KLM_DEFAULT_VALUES, KLM_OPERATORS, KLM_PARAMETER_FILE_VERSION, iter_klm_operators,
+                 compile_klm_scripts, calculate_completion_times, find_klm_files)
+from klm_timing import keystroke_times, pointing_times, click_times, switch_times, extract_klm_values
+from calculator_log_format import read_log
+
+
+DEFAULT_REPLICATES = 10000
+DEFAULT_CONFIDENCE = 0.95
+
+
+def operator_intervals(k_log, p_log, b_log, h_log) -> dict[str, np.ndarray]:
+    """
+    Returns the measured intervals of the K, P, B and H operators (the same ones extract_klm_values() takes the
+    medians of).
+    """
+    return {
+        "K": keystroke_times(k_log),
+        "P": pointing_times(p_log),
+        "B": click_times(b_log),
+        "H": switch_times(h_log),
+    }
+
+
+def _bootstrap_chunk(samples: np.ndarray, replicates: int, seed: np.random.SeedSequence) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(0, len(samples), size=(replicates, len(samples)))
+    return np.median(samples[indices], axis=1)
+
+
+def bootstrap_medians(samples_by_operator: dict[str, np.ndarray], replicates: int = DEFAULT_REPLICATES,
+                      seed: int = None, workers: int = None, chunk_size: int = 1000) -> dict[str, np.ndarray]:
+    """
+    Draws the bootstrap replicates of the median for every operator.
+
+    The replicates are split into chunks with their own random streams (spawned from the seed), so the result only
+    depends on the seed and the chunk size but not on the number of worker processes.
+
+    :param samples_by_operator: the measured intervals per operator
+    :param replicates: the number of bootstrap replicates per operator
+    :param seed: the seed of the random numbers (None for a random seed)
+    :param workers: the number of worker processes (defaults to the number of cores, 1 to run in this process)
+    :param chunk_size: the number of replicates that are drawn at once
+    :return: an array with the median of every replicate per operator
+    """
+    jobs = []
+    operator_seeds = np.random.SeedSequence(seed).spawn(len(samples_by_operator))
+    for (operator, samples), operator_seed in zip(samples_by_operator.items(), operator_seeds):
+        samples = np.asarray(samples, dtype=np.float64)
+        if len(samples) == 0:
+            raise ValueError(f"There are no measured intervals for the {operator} operator!")
+        chunk_sizes = [min(chunk_size, replicates - start) for start in range(0, replicates, chunk_size)]
+        for size, chunk_seed in zip(chunk_sizes, operator_seed.spawn(len(chunk_sizes))):
+            jobs.append((operator, samples, size, chunk_seed))
+
+    if workers == 1 or len(jobs) <= 1:
+        chunks = [_bootstrap_chunk(samples, size, chunk_seed) for _, samples, size, chunk_seed in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(_bootstrap_chunk, *zip(*[job[1:] for job in jobs])))
+
+    medians = {operator: [] for operator in samples_by_operator}
+    for (operator, *_), chunk in zip(jobs, chunks):
+        medians[operator].append(chunk)
+    return {operator: np.concatenate(operator_chunks) for operator, operator_chunks in medians.items()}
+
+
+def confidence_interval(replicates: np.ndarray, confidence: float = DEFAULT_CONFIDENCE, axis: int = -1) -> np.ndarray:
+    """
+    Returns the lower and upper bound of the percentile bootstrap confidence interval.
+    """
+    alpha = (1 - confidence) / 2
+    return np.quantile(replicates, [alpha, 1 - alpha], axis=axis)
+
+
+def calibrate(k_log_file: str, p_log_file: str, b_log_file: str, h_log_file: str, task_files: list[str] = (),
+              replicates: int = DEFAULT_REPLICATES, confidence: float = DEFAULT_CONFIDENCE, seed: int = None,
+              workers: int = None, decimals: int = 3) -> dict:
+    """
+    Calibrates the klm values from the four operator logs and predicts the given task scripts.
+
+    :return: the content of the parameter file (see write_parameter_file())
+    """
+    logs = {operator: read_log(log_file) for operator, log_file in
+            (("K", k_log_file), ("P", p_log_file), ("B", b_log_file), ("H", h_log_file))}
+    klm_values = extract_klm_values(logs["K"], logs["P"], logs["B"], logs["H"], decimals)
+    samples = operator_intervals(logs["K"], logs["P"], logs["B"], logs["H"])
+
+    if seed is None:
+        # keep the random seed, so the calibration can be reproduced from the parameter file
+        seed = int(np.random.SeedSequence().entropy)
+    replicate_medians = bootstrap_medians(samples, replicates, seed, workers)
+
+    # (operators x replicates) value matrix; the operators that weren't measured (M) have the same value everywhere
+    value_matrix = np.empty((len(KLM_OPERATORS), replicates), dtype=np.float64)
+    for row, operator in enumerate(KLM_OPERATORS):
+        value_matrix[row] = replicate_medians.get(operator, klm_values.get(operator, KLM_DEFAULT_VALUES[operator]))
+
+    tasks = {}
+    if task_files:
+        point_values = np.array([klm_values[operator] for operator in KLM_OPERATORS])
+        script_matrix = compile_klm_scripts("".join(iter_klm_operators(task_file)) for task_file in task_files)
+        task_times = calculate_completion_times(script_matrix, value_matrix)
+        task_intervals = confidence_interval(task_times, confidence)
+        for row, task_file in enumerate(task_files):
+            tasks[task_file] = {
+                "time": round(float(script_matrix[row] @ point_values), decimals),
+                "confidence_interval": [round(float(bound), decimals) for bound in task_intervals[:, row]],
+            }
+
+    operator_bounds = {operator: confidence_interval(medians, confidence)
+                       for operator, medians in replicate_medians.items()}
+    return {
+        "version": KLM_PARAMETER_FILE_VERSION,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "logs": {"K": k_log_file, "P": p_log_file, "B": b_log_file, "H": h_log_file},
+        "replicates": replicates,
+        "confidence": confidence,
+        "seed": seed,
+        "values": klm_values,
+        "confidence_intervals": {operator: [round(float(bound), decimals) for bound in bounds]
+                                 for operator, bounds in operator_bounds.items()},
+        "sample_counts": {operator: int(len(operator_samples)) for operator, operator_samples in samples.items()},
+        "tasks": tasks,
+    }
+
+
+def write_parameter_file(parameters: dict, file_name: str) -> None:
+    tmp_file_name = f"{file_name}.{os.getpid()}.tmp"
+    with open(tmp_file_name, "w") as parameter_file:
+        json.dump(parameters, parameter_file, indent=2)
+    os.replace(tmp_file_name, file_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrates the klm operator values from the calculator logs with "
+                                                 "bootstrap confidence intervals.")
+    parser.add_argument("k_log", help="log of the keystroke task", type=str)
+    parser.add_argument("p_log", help="log of the pointing task", type=str)
+    parser.add_argument("b_log", help="log of the button press task", type=str)
+    parser.add_argument("h_log", help="log of the hand switching task", type=str)
+    parser.add_argument("-t", "--tasks", help="klm task scripts (files, directories or glob patterns) whose completion "
+                                              "times are predicted with the calibrated values", type=str, nargs="*",
+                        default=[])
+    parser.add_argument("-o", "--output", help="the parameter file to write (default: klm_values.json)", type=str,
+                        default="klm_values.json")
+    parser.add_argument("-r", "--replicates", help=f"number of bootstrap replicates (default: {DEFAULT_REPLICATES})",
+                        type=int, default=DEFAULT_REPLICATES)
+    parser.add_argument("-c", "--confidence", help=f"confidence level of the intervals (default: "
+                                                   f"{DEFAULT_CONFIDENCE})", type=float, default=DEFAULT_CONFIDENCE)
+    parser.add_argument("-s", "--seed", help="seed for the bootstrap (default: random)", type=int, default=None)
+    parser.add_argument("-j", "--workers", help="number of worker processes (default: number of cores)", type=int,
+                        default=None)
+    args = parser.parse_args()
+
+    parameters = calibrate(args.k_log, args.p_log, args.b_log, args.h_log, find_klm_files(args.tasks),
+                           args.replicates, args.confidence, args.seed, args.workers)
+    write_parameter_file(parameters, args.output)
+
+    percent = f"{args.confidence:.0%}"
+    for operator, value in parameters["values"].items():
+        bounds = parameters["confidence_intervals"].get(operator)
+        interval = f" ({percent} CI: {bounds[0]:0.3f} - {bounds[1]:0.3f})" if bounds else ""
+        print(f"{operator}: {value:0.3f} seconds{interval}")
+    for task_file, task in parameters["tasks"].items():
+        bounds = task["confidence_interval"]
+        print(f"{task_file}: {task['time']:0.3f} seconds ({percent} CI: {bounds[0]:0.3f} - {bounds[1]:0.3f})")
+    print(f"Parameters written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Reads the participant logs of the calculator experiment (calculator_experiment.py) and segments them into the actual
+task completion times. Each log is segmented with vectorized numpy operations and the logs are processed in parallel,
+so the ingestion scales with the number of cores for studies with many participants.
+
+Usage:
+    python klm_experiment.py [directory] [-o task_times.csv]
+"""
+
+import os
+import re
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from calculator_log_format import read_log, event_times
+
+
+PARTICIPANT_LOG_PATTERN = "calculator_experiment_p_*.csv"
+TASK_TIME_COLUMNS = ["participant", "trial", "condition", "restarts", "duration"]
+
+_PARTICIPANT_ID_REGEX = re.compile(r"_p_(\d+)")
+
+
+def discover_participant_logs(directory: str = ".", pattern: str = PARTICIPANT_LOG_PATTERN) -> dict[int, str]:
+    """
+    Finds all participant logs in the given directory.
+
+    :return: a dict that maps the participant id (taken from the file name) to the log file, sorted by id
+    """
+    participant_logs = {}
+    for file_name in glob.glob(os.path.join(directory, pattern)):
+        match = _PARTICIPANT_ID_REGEX.search(os.path.basename(file_name))
+        if match:
+            participant_logs[int(match.group(1))] = file_name
+    return dict(sorted(participant_logs.items()))
+
+
+def segment_tasks(log: pd.DataFrame, participant: int = 0) -> pd.DataFrame:
+    """
+    Segments a single participant log into task completion times. A task starts with the first event after the last
+    task_started or task_restarted event (the user's first input) and ends with the task_finished event.
+
+    Instead of iterating over the rows, the index of the last (re)start event is propagated to every row with a
+    cumulative maximum, so every task_finished row can directly look up its start.
+
+    :param log: the participant log in the CalculatorLogger schema
+    :param participant: the participant id that is written into the result
+    :return: a DataFrame with the columns in TASK_TIME_COLUMNS and one row per finished task
+    """
+    event_types = log["eventType"].to_numpy(dtype=object)
+    time_stamps = event_times(log)
+    row_indices = np.arange(len(log))
+
+    is_started = event_types == "task_started"
+    is_restarted = event_types == "task_restarted"
+    finished_rows = np.flatnonzero(event_types == "task_finished")
+
+    last_start = np.maximum.accumulate(np.where(is_started | is_restarted, row_indices, -1))[finished_rows]
+    last_task_started = np.maximum.accumulate(np.where(is_started, row_indices, -1))[finished_rows]
+    restart_count = np.cumsum(is_restarted)
+
+    # skip tasks that were finished without being started
+    valid = last_start >= 0
+    finished_rows, last_start, last_task_started = finished_rows[valid], last_start[valid], last_task_started[valid]
+
+    restarts = restart_count[finished_rows] - np.where(last_task_started >= 0,
+                                                       restart_count[np.maximum(last_task_started, 0)], 0)
+    return pd.DataFrame({
+        "participant": np.full(len(finished_rows), participant, dtype=np.int64),
+        "trial": np.arange(len(finished_rows), dtype=np.int64),
+        "condition": pd.to_numeric(log["argument"].to_numpy(dtype=object)[finished_rows]).astype(np.int64),
+        "restarts": restarts.astype(np.int64),
+        "duration": time_stamps[finished_rows] - time_stamps[last_start + 1],
+    }, columns=TASK_TIME_COLUMNS)
+
+
+def segment_log_file(participant: int, file_name: str) -> pd.DataFrame:
+    return segment_tasks(read_log(file_name), participant)
+
+
+def ingest_experiment(directory: str = ".", pattern: str = PARTICIPANT_LOG_PATTERN,
+                      workers: int = None) -> pd.DataFrame:
+    """
+    Discovers all participant logs in the directory and segments them in a process pool.
+
+    :param workers: the number of worker processes (defaults to the number of cores)
+    :return: a tidy DataFrame with one row per participant and finished task (see segment_tasks())
+    """
+    participant_logs = discover_participant_logs(directory, pattern)
+    if not participant_logs:
+        return pd.DataFrame(columns=TASK_TIME_COLUMNS)
+
+    if len(participant_logs) == 1 or workers == 1:
+        task_times = [segment_log_file(participant, file_name) for participant, file_name in participant_logs.items()]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            task_times = list(executor.map(segment_log_file, participant_logs.keys(), participant_logs.values()))
+    return pd.concat(task_times, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Segments the calculator experiment logs into task completion times.")
+    parser.add_argument("directory", help="directory containing the participant logs (default: .)", type=str,
+                        nargs="?", default=".")
+    parser.add_argument("-p", "--pattern", help=f"file pattern of the participant logs (default: "
+                                                f"{PARTICIPANT_LOG_PATTERN})",
+                        type=str, default=PARTICIPANT_LOG_PATTERN)
+    parser.add_argument("-o", "--output", help="write the task times to this csv file instead of stdout", type=str,
+                        default=None)
+    parser.add_argument("-j", "--workers", help="number of worker processes (default: number of cores)", type=int,
+                        default=None)
+    args = parser.parse_args()
+
+    task_times = ingest_experiment(args.directory, args.pattern, args.workers)
+    if args.output:
+        task_times.to_csv(args.output, index=False)
+    else:
+        print(task_times.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Generates the fastest KLM operator sequence for entering an expression into the calculator.
+
+Every token of the expression can either be typed (K operators) or clicked (P + BB for pressing and releasing the
+mouse button); switching between the keyboard and the mouse costs an H operator. The planner finds the cheapest
+combination with a dynamic program over the states (position in the expression, device used last, button the mouse
+cursor is on). For every position only the cheapest way to reach each state is kept, so the cost is linear in the
+length of the expression. If a fitts.FittsModel is given, the P operators are scored with Fitts' law and the position
+of the cursor matters; otherwise every P costs the constant value from the klm values.
+
+The plans are written in the text format read by klm.parse_klm_file().
+
+Usage:
+    python klm_planner.py "(3*3+4*4)*15.2"
+    python klm_planner.py -f expressions.txt -o klm_plans --ui-file calculator.ui --p-log klm_p_log.csv
+"""
+
+import os
+import argparse
+
+import numpy as np
+
+from klm import KLM_DEFAULT_VALUES
+
+
+KEYBOARD = "keyboard"
+MOUSE = "mouse"
+_DEVICES = (KEYBOARD, MOUSE)
+
+CALCULATOR_BUTTONS = tuple("0123456789+-*/().=") + ("Clear", "DEL")
+# the tokens the calculator accepts from the keyboard (see IttCalculator.keyPressEvent())
+KEYBOARD_TOKENS = tuple("0123456789+-*/().=") + ("DEL",)
+
+# keystrokes needed for a token on a german keyboard layout (as in klm_tasks), the other tokens need a single key;
+# "=" is entered with the return key
+KEYSTROKE_COUNTS = {"(": 2, ")": 2, "*": 2, "/": 2}
+
+
+def tokenize_expression(expression: str, evaluate: bool = True) -> list[str]:
+    """
+    Splits an expression into the calculator buttons that have to be pressed (spaces are ignored).
+
+    :param evaluate: whether "=" is pressed at the end (if the expression doesn't end with it yet)
+    """
+    tokens = [character for character in expression if not character.isspace()]
+    if evaluate and tokens[-1:] != ["="]:
+        tokens.append("=")
+    return tokens
+
+
+class KlmPlan:
+    """
+    The cheapest way to enter an expression: the device used for every token, the operators for every token and the
+    predicted time in seconds.
+    """
+    __slots__ = ("tokens", "devices", "token_operators", "time")
+
+    def __init__(self, tokens: list[str], devices: list[str], token_operators: list[str], time: float):
+        self.tokens = tokens
+        self.devices = devices
+        self.token_operators = token_operators
+        self.time = time
+
+    @property
+    def operators(self) -> str:
+        return "".join(self.token_operators)
+
+    @property
+    def pointing_targets(self) -> list[str]:
+        """
+        The buttons the P operators point at (for klm.calculate_completion_time() with a Fitts' law model).
+        """
+        return [token for token, device in zip(self.tokens, self.devices) if device == MOUSE]
+
+    def to_klm_text(self, title: str = None) -> str:
+        """
+        Returns the plan in the klm file format (one line per token with a comment).
+        """
+        lines = [f"# {title}", ""] if title else []
+        lines += [f"{operators}  # {'click' if device == MOUSE else 'type'} \"{token}\""
+                  for token, device, operators in zip(self.tokens, self.devices, self.token_operators)]
+        return "\n".join(lines) + "\n"
+
+
+class KlmPlanner:
+    """
+    Plans the operator sequences for a calculator layout. Plans are memoized per expression, so generated expression
+    sets with many duplicates are only planned once.
+    """
+
+    def __init__(self, klm_value_dict: dict[str, float] = None, fitts_model=None, buttons=CALCULATOR_BUTTONS,
+                 keystroke_counts: dict[str, int] = None, start_device: str = None):
+        """
+        :param klm_value_dict: the times of the operators (default: klm.KLM_DEFAULT_VALUES)
+        :param fitts_model: optional fitts.FittsModel of the layout for scoring the P operators
+        :param buttons: the tokens that can be clicked (ignored if a fitts_model is given, its buttons are used then)
+        :param keystroke_counts: keystrokes per token if it needs more than one (default: KEYSTROKE_COUNTS)
+        :param start_device: the device the hand is on at the start (None: no H for the first token)
+        """
+        self.klm_values = KLM_DEFAULT_VALUES if klm_value_dict is None else klm_value_dict
+        self.fitts_model = fitts_model
+        self.buttons = fitts_model.buttons if fitts_model is not None else tuple(buttons)
+        self.keystroke_counts = KEYSTROKE_COUNTS if keystroke_counts is None else keystroke_counts
+        if start_device not in (None,) + _DEVICES:
+            raise ValueError(f"Unknown start device {start_device}!")
+        self.start_device = start_device
+        self.__button_indices = {button: index for index, button in enumerate(self.buttons)}
+        self.__plans = {}
+
+        # pointing_costs[c, j]: P time from cursor position c to button j; the last row is the unknown start position
+        count = len(self.buttons)
+        if fitts_model is not None:
+            self.__pointing_costs = fitts_model.movement_times(fitts_model.id_matrix)
+        else:
+            self.__pointing_costs = np.full((count + 1, count), self.klm_values["P"], dtype=np.float64)
+        self.__click_cost = 2 * self.klm_values["B"]
+
+    def plan(self, expression: str, evaluate: bool = True) -> KlmPlan:
+        key = (expression, evaluate)
+        if key not in self.__plans:
+            self.__plans[key] = self.plan_tokens(tokenize_expression(expression, evaluate))
+        return self.__plans[key]
+
+    def plan_tokens(self, tokens: list[str]) -> KlmPlan:
+        """
+        Runs the dynamic program. costs[d, c] is the min. time for the tokens so far that ends with device d and the
+        mouse cursor on button c (row len(buttons) of the cursor axis is the unknown start position).
+        """
+        keystroke_time = self.klm_values["K"]
+        homing_time = self.klm_values["H"]
+        cursor_count = len(self.buttons) + 1
+        unknown_cursor = cursor_count - 1
+
+        costs = np.full((2, cursor_count), np.inf)
+        if self.start_device is None:
+            costs[:, unknown_cursor] = 0.0
+        else:
+            costs[_DEVICES.index(self.start_device), unknown_cursor] = 0.0
+
+        # back pointers: for the keyboard the previous device per cursor, for the mouse the previous (device, cursor)
+        keyboard_sources = []
+        mouse_sources = []
+        for position, token in enumerate(tokens):
+            if token not in KEYBOARD_TOKENS and token not in self.__button_indices:
+                raise ValueError(f"Token {token!r} can't be entered into the calculator!")
+            # there is nothing to switch from before the first token if the start device is unknown
+            switch_time = 0.0 if position == 0 and self.start_device is None else homing_time
+
+            new_costs = np.full((2, cursor_count), np.inf)
+            from_mouse_to_keyboard = costs[1] + switch_time
+            keyboard_sources.append((from_mouse_to_keyboard < costs[0]).astype(np.int8))
+            if token in KEYBOARD_TOKENS:
+                new_costs[0] = (np.minimum(costs[0], from_mouse_to_keyboard)
+                                + self.keystroke_counts.get(token, 1) * keystroke_time)
+
+            target = self.__button_indices.get(token)
+            if target is not None:
+                before_click = np.stack((costs[0] + switch_time, costs[1])) + self.__pointing_costs[:, target]
+                source = int(np.argmin(before_click))
+                new_costs[1, target] = before_click.flat[source] + self.__click_cost
+                mouse_sources.append(divmod(source, cursor_count))
+            else:
+                mouse_sources.append(None)
+            costs = new_costs
+
+        if not np.isfinite(costs).any():
+            raise ValueError(f"Tokens {tokens} can't be entered!")
+        device, cursor = divmod(int(np.argmin(costs)), cursor_count)
+        total_time = float(costs[device, cursor])
+
+        # follow the back pointers from the last token to the first one
+        devices = []
+        for position in range(len(tokens) - 1, -1, -1):
+            devices.append(_DEVICES[device])
+            if device == 0:
+                device = int(keyboard_sources[position][cursor])
+            else:
+                device, cursor = mouse_sources[position]
+        devices.reverse()
+
+        token_operators = []
+        previous_device = self.start_device
+        for token, device in zip(tokens, devices):
+            switch = "H" if previous_device is not None and device != previous_device else ""
+            if device == MOUSE:
+                token_operators.append(f"{switch}PBB")
+            else:
+                keystrokes = self.keystroke_counts.get(token, 1)
+                token_operators.append(f"{switch}{keystrokes if keystrokes > 1 else ''}K")
+            previous_device = device
+        return KlmPlan(list(tokens), devices, token_operators, total_time)
+
+    def plan_many(self, expressions, evaluate: bool = True) -> list[KlmPlan]:
+        return [self.plan(expression, evaluate) for expression in expressions]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates the fastest klm operator sequence for entering "
+                                                 "expressions into the calculator.")
+    parser.add_argument("expressions", help="the expressions to plan", type=str, nargs="*")
+    parser.add_argument("-f", "--file", help="read the expressions from this file (one per line)", type=str,
+                        default=None)
+    parser.add_argument("-o", "--output-dir", help="write one klm file per expression into this directory instead of "
+                                                   "printing the plans", type=str, default=None)
+    parser.add_argument("--ui-file", help="score the P operators with Fitts' law for the layout of this .ui file "
+                                          "(needs --p-log)", type=str, default=None)
+    parser.add_argument("--p-log", help="pointing log for fitting the Fitts' law coefficients", type=str,
+                        default=None)
+    parser.add_argument("--start-device", help="the device the hand is on at the start (default: none, i.e. no H "
+                                               "operator for the first input)", choices=_DEVICES, default=None)
+    args = parser.parse_args()
+
+    expressions = list(args.expressions)
+    if args.file:
+        with open(args.file) as expression_file:
+            expressions += [line.strip() for line in expression_file if line.strip()]
+    if not expressions:
+        parser.error("no expressions given")
+
+    fitts_model = None
+    if args.ui_file:
+        if not args.p_log:
+            parser.error("--ui-file needs --p-log")
+        from fitts import FittsModel
+        from calculator_log_format import read_log
+        fitts_model = FittsModel.from_ui_file(args.ui_file).fit(read_log(args.p_log))
+
+    planner = KlmPlanner(fitts_model=fitts_model, start_device=args.start_device)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    for number, expression in enumerate(expressions, start=1):
+        plan = planner.plan(expression)
+        text = plan.to_klm_text(f"{expression}: {plan.time:0.3f} seconds")
+        if args.output_dir:
+            with open(os.path.join(args.output_dir, f"plan{number}.txt"), "w") as klm_file:
+                klm_file.write(text)
+        else:
+            print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Builds the long-format table of predicted and actual task completion times that klm_report.ipynb plots
+(merged_df_long), with a cache for the participant logs.
+
+The task times of every participant log (see klm_experiment.segment_tasks()) are stored in a columnar .npz cache
+file together with the size, modification time and sha256 hash of the log. On the next run a log is only read and
+segmented again if it is new or its content changed (the hash is only calculated if size or mtime differ), so adding
+one participant to a large study only costs the time for that one log. The predictions for the task scripts are
+cheap and calculated on every run, so changed scripts or klm values are always taken into account.
+
+Usage:
+    python klm_report_data.py . -t klm_tasks -o merged_df_long.csv
+"""
+
+import os
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from klm import evaluate_klm_file, find_klm_files, load_klm_values
+from klm_experiment import PARTICIPANT_LOG_PATTERN, TASK_TIME_COLUMNS, discover_participant_logs, segment_log_file
+
+
+REPORT_CACHE_VERSION = 1
+REPORT_CACHE_FILE_NAME = "klm_report_cache.npz"
+# the task scripts are next to this module, so the defaults work no matter from where the report is built
+_TASK_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "klm_tasks")
+DEFAULT_TASK_FILES = [os.path.join(_TASK_DIRECTORY, f"task{task_id}.txt") for task_id in range(1, 5)]
+
+# the time types of the long-format table (same names as in klm_report.ipynb)
+TIME_TYPES = ("klm_default", "klm_custom", "klm_actual")
+REPORT_COLUMNS = ["task_id", "participant", "time_type", "time_in_s"]
+
+
+def _file_hash(file_name: str) -> str:
+    file_hash = hashlib.sha256()
+    with open(file_name, "rb") as log_file:
+        for block in iter(lambda: log_file.read(1 << 20), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+class _CacheEntry:
+    """
+    The task times of one participant log and the signature of the log they were calculated from.
+    """
+    __slots__ = ("participant", "size", "mtime_ns", "sha256", "columns")
+
+    def __init__(self, participant: int, size: int, mtime_ns: int, sha256: str, columns: dict[str, np.ndarray]):
+        self.participant = participant
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.sha256 = sha256
+        self.columns = columns
+
+
+class TaskTimeCache:
+    """
+    Keeps the segmented task times of the participant logs in a columnar .npz file: one array per column of
+    TASK_TIME_COLUMNS with the rows of all logs, plus the file names, signatures and row offsets of the logs.
+    """
+
+    def __init__(self, cache_file: str = None):
+        """
+        :param cache_file: the .npz file of the cache (None for a cache that is only kept in memory)
+        """
+        self.cache_file = cache_file
+        self.__entries = {}
+        # the logs that had to be segmented again in the last update()
+        self.recomputed_files = []
+        if cache_file is not None and os.path.isfile(cache_file):
+            self.__load()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __load(self) -> None:
+        try:
+            with np.load(self.cache_file, allow_pickle=False) as data:
+                if int(data["version"]) != REPORT_CACHE_VERSION:
+                    return
+                offsets = data["offsets"]
+                columns = {column: data[column] for column in TASK_TIME_COLUMNS}
+                for index, file_name in enumerate(data["files"].tolist()):
+                    rows = slice(offsets[index], offsets[index + 1])
+                    self.__entries[file_name] = _CacheEntry(
+                        int(data["participants"][index]), int(data["sizes"][index]), int(data["mtimes_ns"][index]),
+                        str(data["hashes"][index]), {column: values[rows] for column, values in columns.items()})
+        except (OSError, KeyError, ValueError):
+            # a broken cache file is simply rebuilt
+            self.__entries = {}
+
+    def save(self) -> None:
+        if self.cache_file is None:
+            return
+        entries = list(self.__entries.items())
+        row_counts = [len(entry.columns["trial"]) for _, entry in entries]
+        arrays = {
+            "version": np.array(REPORT_CACHE_VERSION),
+            "files": np.array([file_name for file_name, _ in entries], dtype=str),
+            "participants": np.array([entry.participant for _, entry in entries], dtype=np.int64),
+            "sizes": np.array([entry.size for _, entry in entries], dtype=np.int64),
+            "mtimes_ns": np.array([entry.mtime_ns for _, entry in entries], dtype=np.int64),
+            "hashes": np.array([entry.sha256 for _, entry in entries], dtype=str),
+            "offsets": np.concatenate(([0], np.cumsum(row_counts, dtype=np.int64))),
+        }
+        for column in TASK_TIME_COLUMNS:
+            arrays[column] = self.__concatenate(column, [entry for _, entry in entries])
+
+        tmp_file_name = f"{self.cache_file}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_file_name, **arrays)
+        os.replace(tmp_file_name, self.cache_file)
+
+    @staticmethod
+    def __concatenate(column: str, entries: list[_CacheEntry]) -> np.ndarray:
+        dtype = np.float64 if column == "duration" else np.int64
+        if not entries:
+            return np.zeros(0, dtype=dtype)
+        return np.concatenate([entry.columns[column] for entry in entries]).astype(dtype, copy=False)
+
+    def update(self, participant_logs: dict[int, str], workers: int = None) -> pd.DataFrame:
+        """
+        Brings the cache up to date with the given participant logs and returns the task times of all of them. Only
+        new or changed logs are segmented (in a process pool if there are several), logs that aren't given anymore are
+        removed from the cache.
+
+        :param participant_logs: participant id -> log file, e.g. from klm_experiment.discover_participant_logs()
+        :param workers: the number of worker processes (defaults to the number of cores)
+        :return: a DataFrame with the columns in TASK_TIME_COLUMNS
+        """
+        entries = {}
+        stale_logs = {}
+        changed = False
+        for participant, file_name in participant_logs.items():
+            stat = os.stat(file_name)
+            entry = self.__entries.get(file_name)
+            if entry is not None and entry.participant == participant and entry.size == stat.st_size:
+                if entry.mtime_ns == stat.st_mtime_ns:
+                    entries[file_name] = entry
+                    continue
+                # the file was touched, but maybe its content is still the same
+                sha256 = _file_hash(file_name)
+                if sha256 == entry.sha256:
+                    entry.mtime_ns = stat.st_mtime_ns
+                    entries[file_name] = entry
+                    changed = True
+                    continue
+            else:
+                sha256 = _file_hash(file_name)
+            stale_logs[file_name] = (participant, stat.st_size, stat.st_mtime_ns, sha256)
+
+        self.recomputed_files = list(stale_logs)
+        if stale_logs:
+            participants = [participant for participant, *_ in stale_logs.values()]
+            if len(stale_logs) == 1 or workers == 1:
+                task_times = [segment_log_file(participant, file_name)
+                              for participant, file_name in zip(participants, stale_logs)]
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    task_times = list(executor.map(segment_log_file, participants, stale_logs))
+            for (file_name, (participant, size, mtime_ns, sha256)), log_task_times in zip(stale_logs.items(),
+                                                                                         task_times):
+                columns = {column: log_task_times[column].to_numpy() for column in TASK_TIME_COLUMNS}
+                entries[file_name] = _CacheEntry(participant, size, mtime_ns, sha256, columns)
+
+        changed = changed or bool(stale_logs) or len(entries) != len(self.__entries)
+        # keep the logs ordered by participant, like in participant_logs
+        self.__entries = {file_name: entries[file_name] for file_name in participant_logs.values()}
+        if changed:
+            self.save()
+
+        entry_list = list(self.__entries.values())
+        return pd.DataFrame({column: self.__concatenate(column, entry_list) for column in TASK_TIME_COLUMNS},
+                            columns=TASK_TIME_COLUMNS)
+
+
+def predict_tasks(task_files: list[str], custom_values: dict[str, float] = None) -> pd.DataFrame:
+    """
+    Returns the default and custom klm predictions of the task scripts. The task ids are the positions of the files
+    in task_files (like in klm_report.ipynb), so they match the conditions logged by calculator_experiment.py.
+    """
+    rows = []
+    for task_id, task_file in enumerate(task_files):
+        result = evaluate_klm_file(task_file, custom_values=custom_values)
+        if result["error"]:
+            raise ValueError(f"{task_file}: {result['error']}")
+        rows.append((task_id, result["time_default_in_s"], result["time_custom_in_s"]))
+    return pd.DataFrame(rows, columns=["task_id", "klm_default", "klm_custom"])
+
+
+def long_format_table(predictions: pd.DataFrame, task_times: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merges the predictions with the measured task times into the long format of merged_df_long in klm_report.ipynb:
+    one row per participant, task and time type. The predictions are repeated for every measured task.
+    """
+    actual = task_times.rename(columns={"condition": "task_id", "duration": "klm_actual"})
+    merged = actual[["task_id", "participant", "klm_actual"]].merge(predictions, on="task_id", how="inner")
+    merged = merged.sort_values(["participant", "task_id"], kind="stable")
+    table = merged.melt(id_vars=["task_id", "participant"], value_vars=list(TIME_TYPES), var_name="time_type",
+                        value_name="time_in_s")
+    return table[REPORT_COLUMNS].reset_index(drop=True)
+
+
+def build_report_table(directory: str = ".", task_files: list[str] = None, pattern: str = PARTICIPANT_LOG_PATTERN,
+                       cache_file: str = "", workers: int = None,
+                       custom_values: dict[str, float] = None) -> pd.DataFrame:
+    """
+    Runs the whole stage: predicts the task scripts, updates the task time cache with the participant logs in the
+    directory and returns the long-format table.
+
+    :param cache_file: the cache file ("" for klm_report_cache.npz in the directory, None to disable the cache)
+    """
+    if cache_file == "":
+        cache_file = os.path.join(directory, REPORT_CACHE_FILE_NAME)
+    predictions = predict_tasks(DEFAULT_TASK_FILES if task_files is None else task_files, custom_values)
+    task_times = TaskTimeCache(cache_file).update(discover_participant_logs(directory, pattern), workers)
+    return long_format_table(predictions, task_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the table of predicted and actual task times for the klm "
+                                                 "report, only new or changed participant logs are read again.")
+    parser.add_argument("directory", help="directory containing the participant logs (default: .)", type=str,
+                        nargs="?", default=".")
+    parser.add_argument("-t", "--tasks", help="the klm task scripts in the order of the task ids (files, directories "
+                                              "or glob patterns)", type=str, nargs="+", default=DEFAULT_TASK_FILES)
+    parser.add_argument("-p", "--pattern", help=f"file pattern of the participant logs (default: "
+                                                f"{PARTICIPANT_LOG_PATTERN})", type=str,
+                        default=PARTICIPANT_LOG_PATTERN)
+    parser.add_argument("-o", "--output", help="write the table to this csv file instead of stdout", type=str,
+                        default=None)
+    parser.add_argument("--cache", help=f"the cache file (default: {REPORT_CACHE_FILE_NAME} in the directory)",
+                        type=str, default="")
+    parser.add_argument("--no-cache", help="read all participant logs again without a cache", action="store_true")
+    parser.add_argument("-j", "--workers", help="number of worker processes (default: number of cores)", type=int,
+                        default=None)
+    parser.add_argument("--klm-values", help="use the calibrated values from this parameter file (see "
+                                             "klm_calibration.py) as custom values", type=str, default=None)
+    args = parser.parse_args()
+
+    table = build_report_table(args.directory, find_klm_files(args.tasks), args.pattern,
+                               None if args.no_cache else args.cache, args.workers,
+                               load_klm_values(args.klm_values) if args.klm_values else None)
+    if args.output:
+        table.to_csv(args.output, index=False)
+    else:
+        print(table.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
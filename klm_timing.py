@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Vectorized extraction of the klm operator times from the calculator logs (see calculator_klm.ipynb for a description
+of the logged tasks). All intervals are computed with shifted numpy arrays instead of iterating over the rows, so
+even logs with millions of events are processed in a fraction of a second.
+
+Usage:
+    python klm_timing.py klm_k_log.csv klm_p_log.csv klm_b_log.csv klm_h_log.csv
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from klm import KLM_DEFAULT_VALUES
+from calculator_log_format import read_log, event_times
+
+
+def _event_types(log: pd.DataFrame) -> np.ndarray:
+    return log["eventType"].to_numpy(dtype=object)
+
+
+def _is_mouse(log: pd.DataFrame) -> np.ndarray:
+    # missing values (e.g. for task events in the experiment logs) count as keyboard events
+    is_mouse = log["isMouse"]
+    if is_mouse.dtype == bool or isinstance(is_mouse.dtype, pd.BooleanDtype):
+        return is_mouse.to_numpy(dtype=bool, na_value=False)
+    return is_mouse.astype(str).isin(("True", "1", "1.0")).to_numpy()
+
+
+def keystroke_times(log: pd.DataFrame) -> np.ndarray:
+    """
+    Returns the time between every keystroke and the keystroke directly before it.
+    """
+    event_types = _event_types(log)
+    time_stamps = event_times(log)
+    is_keystroke = event_types == "keyStroke"
+    follows_keystroke = is_keystroke[1:] & is_keystroke[:-1]
+    return np.diff(time_stamps)[follows_keystroke]
+
+
+def _mouse_move_runs(event_types: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the first and last index of every run of directly following mouseMove events.
+    """
+    is_move = np.concatenate(([False], event_types == "mouseMove", [False])).astype(np.int8)
+    edges = np.diff(is_move)
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1
+
+
+def _pointing_runs(event_types: np.ndarray, min_hovers: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the first and last index of every mouseMove run that lies directly between two mouse clicks and contains
+    at least min_hovers hover events.
+    """
+    run_starts, run_ends = _mouse_move_runs(event_types)
+    is_click = np.concatenate((event_types == "mouseClick", [False]))
+    valid = ((run_starts > 0) & is_click[run_starts - 1] & is_click[run_ends + 1]
+             & (run_ends - run_starts + 1 >= min_hovers))
+    return run_starts[valid], run_ends[valid]
+
+
+def pointing_times(log: pd.DataFrame, min_hovers: int = 3) -> np.ndarray:
+    """
+    Returns the pointing times between two clicks: from the click before a run of hover (mouseMove) events to the last
+    hover event directly before the next click. Runs with less than min_hovers hover events are skipped, as such small
+    movements are often not intended by the user (same rules as in calculator_klm.ipynb).
+    """
+    time_stamps = event_times(log)
+    run_starts, run_ends = _pointing_runs(_event_types(log), min_hovers)
+    return time_stamps[run_ends] - time_stamps[run_starts - 1]
+
+
+def hover_to_click_times(log: pd.DataFrame, min_hovers: int = 3) -> np.ndarray:
+    """
+    Returns the pointing segments from the first hover event after a click to the following click.
+    """
+    time_stamps = event_times(log)
+    run_starts, run_ends = _pointing_runs(_event_types(log), min_hovers)
+    return time_stamps[run_ends + 1] - time_stamps[run_starts]
+
+
+def hover_to_click_segments(log: pd.DataFrame, min_hovers: int = 3) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the same segments as hover_to_click_times() together with the buttons they start and end at.
+
+    :return: the button clicked before every segment, the button clicked at its end and the segment durations
+    """
+    time_stamps = event_times(log)
+    run_starts, run_ends = _pointing_runs(_event_types(log), min_hovers)
+    buttons = log[log.columns[4]].astype(str).to_numpy(dtype=object)
+    return buttons[run_starts - 1], buttons[run_ends + 1], time_stamps[run_ends + 1] - time_stamps[run_starts]
+
+
+def click_times(log: pd.DataFrame) -> np.ndarray:
+    """
+    Returns the time between every mouse click and the mouse event (hover or click) directly before it.
+    """
+    event_types = _event_types(log)
+    time_stamps = event_times(log)
+    follows_mouse_event = (event_types[1:] == "mouseClick") & _is_mouse(log)[:-1]
+    return np.diff(time_stamps)[follows_mouse_event]
+
+
+def switch_times(log: pd.DataFrame) -> np.ndarray:
+    """
+    Returns the time between every two successive events that were made with different input devices (mouse and
+    keyboard).
+    """
+    is_mouse = _is_mouse(log)
+    time_stamps = event_times(log)
+    return np.diff(time_stamps)[is_mouse[1:] != is_mouse[:-1]]
+
+
+def extract_klm_values(k_log: pd.DataFrame, p_log: pd.DataFrame, b_log: pd.DataFrame, h_log: pd.DataFrame,
+                       decimals: int = 3) -> dict[str, float]:
+    """
+    Calculates the median K, P, B and H times from the four operator logs.
+
+    :param decimals: the number of decimals the values are rounded to (None to keep the exact medians)
+    :return: a dict like klm.KLM_CUSTOM_VALUES; the M operator is taken from klm.KLM_DEFAULT_VALUES as it can't be
+             measured with the calculator
+    """
+
+    klm_values = {
+        "K": float(np.median(keystroke_times(k_log))),
+        "P": float(np.median(pointing_times(p_log))),
+        "H": float(np.median(switch_times(h_log))),
+        "B": float(np.median(click_times(b_log))),
+        "M": KLM_DEFAULT_VALUES["M"],
+    }
+    if decimals is not None:
+        klm_values = {operator: round(value, decimals) for operator, value in klm_values.items()}
+    return klm_values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculates custom klm operator values from the calculator logs.")
+    parser.add_argument("k_log", help="log of the keystroke task", type=str)
+    parser.add_argument("p_log", help="log of the pointing task", type=str)
+    parser.add_argument("b_log", help="log of the button press task", type=str)
+    parser.add_argument("h_log", help="log of the hand switching task", type=str)
+    args = parser.parse_args()
+
+    klm_values = extract_klm_values(read_log(args.k_log), read_log(args.p_log), read_log(args.b_log),
+                                    read_log(args.h_log))
+    print(klm_values)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Collects the logs of several calculator sessions over a local TCP or Unix socket.
+
+A calculator streams its log to the collector if the environment variable CALCULATOR_LOG_SINK is set to the address
+of the collector (see calculator_logger.NetworkLogWriter). Every connection starts with a "hello" message that names
+the log file of the session, followed by "rows" messages with batches of log rows (one json object per line). The rows
+of all sessions that use the same log file are collected in one queue per file and written in batches by a writer task
+that runs the file operations in a thread pool, so the event loop is never blocked by the disk.
+
+The queues are bounded: if the disk can't keep up, the collector stops reading from the connections of that file, the
+socket buffers fill up and the calculators keep their rows in their own queues until the collector catches up. A "sync"
+message is answered with {"type": "synced"} as soon as all rows before it are fsynced.
+
+The logs are written as csv files with the same layout as the local logs (only the file name of the calculator's log
+file is used, always inside the output directory). With --binary they are additionally converted into the binary format
+(see calculator_log_format.py) when the last session of a file ends.
+
+Usage:
+    python log_collector.py --tcp 127.0.0.1:8765 -d collected_logs
+    CALCULATOR_LOG_SINK=tcp://127.0.0.1:8765 python calculator_experiment.py 1
+
+    python log_collector.py --unix /tmp/calculator_logs.sock -d collected_logs --binary
+    CALCULATOR_LOG_SINK=unix:///tmp/calculator_logs.sock python calculator.py
+"""
+
+import os
+import sys
+import csv
+import json
+import signal
+import asyncio
+import argparse
+
+from calculator_log_format import BINARY_LOG_EXTENSION, csv_to_binary
+from calculator_logger import read_log_header
+
+
+# max. length of one message line (a "rows" message contains up to 1000 rows)
+_MESSAGE_LIMIT = 16 * 1024 * 1024
+
+
+class _LogFile:
+    """
+    One collected log file: the queue of row batches of all sessions writing to it and the task that writes them.
+    """
+
+    def __init__(self, path: str, columns: list[str], max_pending_batches: int, batch_size: int):
+        self.path = path
+        self.columns = columns
+        self.sessions = 0
+        self.rows_written = 0
+        self.__batch_size = batch_size
+        self.__queue = asyncio.Queue(maxsize=max_pending_batches)
+        self.__file = None
+        self.__csv_writer = None
+        # the existing file may have been written by an older calculator with fewer columns
+        header = read_log_header(path)
+        self.__file_columns = columns if header is None else header
+        if self.__file_columns != columns[:len(self.__file_columns)]:
+            raise ValueError(f"{os.path.basename(path)} has the columns {self.__file_columns}, not {columns}!")
+        self.task = asyncio.get_running_loop().create_task(self.__run())
+
+    async def put(self, rows: list) -> None:
+        """
+        Queues a batch of rows, waits if the writer task is behind (this is what applies the backpressure).
+        """
+        await self.__queue.put(rows)
+
+    async def sync(self) -> None:
+        synced = asyncio.get_running_loop().create_future()
+        await self.__queue.put(synced)
+        await synced
+
+    async def close(self) -> None:
+        if not self.task.done():
+            await self.__queue.put(None)
+            await self.task
+
+    async def __run(self) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.__open)
+        running = True
+        while running:
+            item = await self.__queue.get()
+            # collect everything that is already waiting so the rows can be written as one batch
+            batch = []
+            sync_requests = []
+            while True:
+                if item is None:
+                    running = False
+                elif isinstance(item, asyncio.Future):
+                    sync_requests.append(item)
+                else:
+                    batch.extend(item)
+                if not running or self.__queue.empty() or len(batch) >= self.__batch_size:
+                    break
+                item = self.__queue.get_nowait()
+
+            try:
+                await loop.run_in_executor(None, self.__write, batch, bool(sync_requests) or not running)
+            except OSError as error:
+                for request in sync_requests:
+                    request.set_exception(error)
+                raise
+            self.rows_written += len(batch)
+            for request in sync_requests:
+                request.set_result(None)
+        await loop.run_in_executor(None, self.__file.close)
+
+    def __open(self) -> None:
+        write_header = not os.path.isfile(self.path) or os.path.getsize(self.path) == 0
+        self.__file = open(self.path, "a", newline="")
+        self.__csv_writer = csv.writer(self.__file, lineterminator="\n")
+        if write_header:
+            self.__csv_writer.writerow(self.__file_columns)
+
+    def __write(self, batch: list, sync: bool) -> None:
+        column_count = len(self.__file_columns)
+        self.__csv_writer.writerows(row[:column_count] for row in batch)
+        self.__file.flush()
+        if sync:
+            os.fsync(self.__file.fileno())
+
+
+class LogCollector:
+    """
+    Accepts the connections of the calculators and writes their rows into one log file per log file name.
+    """
+
+    def __init__(self, output_directory: str, binary: bool = False, batch_size: int = 1000,
+                 max_pending_batches: int = 64):
+        """
+        :param output_directory: the directory the collected logs are written to
+        :param binary: also convert every log into the binary format when its last session ended
+        :param batch_size: number of rows after which the writer task writes without collecting more
+        :param max_pending_batches: max. number of received row batches per log file that wait for the writer task
+        """
+        self.output_directory = output_directory
+        self.binary = binary
+        self.batch_size = batch_size
+        self.max_pending_batches = max_pending_batches
+        self.sessions = 0
+        self.__log_files = {}
+        self.__idle = asyncio.Event()
+        self.__idle.set()
+        os.makedirs(output_directory, exist_ok=True)
+
+    async def start_tcp_server(self, host: str, port: int) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.handle_connection, host, port, limit=_MESSAGE_LIMIT)
+
+    async def start_unix_server(self, path: str) -> asyncio.AbstractServer:
+        if os.path.exists(path):
+            os.remove(path)  # left over from a previous collector
+        return await asyncio.start_unix_server(self.handle_connection, path, limit=_MESSAGE_LIMIT)
+
+    async def wait_until_idle(self) -> None:
+        """
+        Waits until all sessions have ended.
+        """
+        await self.__idle.wait()
+
+    async def close(self) -> None:
+        for log_file in list(self.__log_files.values()):
+            await log_file.close()
+        self.__log_files.clear()
+
+    async def __open_log_file(self, file_name: str, columns: list[str]) -> _LogFile:
+        # only the file name is used, the sessions can't write outside of the output directory
+        file_name = os.path.basename(file_name)
+        if not file_name or file_name.startswith("."):
+            raise ValueError(f"Invalid log file name {file_name!r}!")
+        path = os.path.join(self.output_directory, file_name)
+        log_file = self.__log_files.get(path)
+        if log_file is None:
+            log_file = _LogFile(path, columns, self.max_pending_batches, self.batch_size)
+            self.__log_files[path] = log_file
+        elif log_file.columns != columns:
+            raise ValueError(f"{file_name} is already written with the columns {log_file.columns}, not {columns}!")
+        log_file.sessions += 1
+        return log_file
+
+    async def __release_log_file(self, log_file: _LogFile) -> None:
+        log_file.sessions -= 1
+        if log_file.sessions > 0:
+            return
+        self.__log_files.pop(log_file.path, None)
+        await log_file.close()
+        if self.binary:
+            binary_file = os.path.splitext(log_file.path)[0] + BINARY_LOG_EXTENSION
+            await asyncio.get_running_loop().run_in_executor(None, csv_to_binary, log_file.path, binary_file)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        log_file = None
+        self.sessions += 1
+        self.__idle.clear()
+        try:
+            hello = json.loads(await reader.readline() or "null")
+            if not isinstance(hello, dict) or hello.get("type") != "hello":
+                raise ValueError("The session didn't start with a hello message!")
+            log_file = await self.__open_log_file(str(hello.get("log_file", "")), list(hello.get("columns", [])))
+            print(f"Session {hello.get('pid', '?')} writes to {log_file.path}")
+
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break  # the calculator was closed without a close message, all received rows are kept
+                message = json.loads(line)
+                if message["type"] == "rows":
+                    await log_file.put(message["rows"])
+                elif message["type"] in ("sync", "close"):
+                    await log_file.sync()
+                    writer.write(b'{"type":"synced"}\n')
+                    await writer.drain()
+                    if message["type"] == "close":
+                        break
+                else:
+                    raise ValueError(f"Unknown message type {message['type']}!")
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        except (ValueError, KeyError, TypeError, OSError) as error:
+            sys.stderr.write(f"Closing session: {error}\n")
+        finally:
+            writer.close()
+            if log_file is not None:
+                await self.__release_log_file(log_file)
+            self.sessions -= 1
+            if self.sessions == 0:
+                self.__idle.set()
+
+
+async def serve(collector: LogCollector, tcp_address: str = None, unix_path: str = None) -> None:
+    """
+    Runs the collector until SIGINT / SIGTERM. Then no new sessions are accepted, but the running ones can still send
+    their rows until they end; a second signal stops the collector immediately (rows that are still in transit are
+    lost then, the calculators write everything after that into their local log files).
+    """
+    servers = []
+    if tcp_address:
+        host, port = tcp_address.rsplit(":", 1)
+        servers.append(await collector.start_tcp_server(host.strip("[]"), int(port)))
+        print(f"Listening on tcp://{tcp_address}")
+    if unix_path:
+        servers.append(await collector.start_unix_server(unix_path))
+        print(f"Listening on unix://{unix_path}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signal_number, stop.set)
+        except (NotImplementedError, AttributeError):
+            pass  # not supported on windows, ctrl + c still ends the collector there
+    await stop.wait()
+
+    for server in servers:
+        server.close()
+    if collector.sessions:
+        print(f"Waiting for {collector.sessions} sessions to end (stop again to quit immediately)")
+        stop.clear()
+        waiters = [asyncio.create_task(stop.wait()), asyncio.create_task(collector.wait_until_idle())]
+        _, pending = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        for waiter in pending:
+            waiter.cancel()
+    await collector.close()
+    if unix_path and os.path.exists(unix_path):
+        os.remove(unix_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collects the logs of several calculator sessions over a local "
+                                                 "socket (see CALCULATOR_LOG_SINK).")
+    parser.add_argument("--tcp", help="listen on this address, e.g. 127.0.0.1:8765", type=str, default=None)
+    parser.add_argument("--unix", help="listen on this unix socket, e.g. /tmp/calculator_logs.sock", type=str,
+                        default=None)
+    parser.add_argument("-d", "--directory", help="directory the logs are written to (default: .)", type=str,
+                        default=".")
+    parser.add_argument("--binary", help="also convert the logs into the binary format when their last session ended",
+                        action="store_true")
+    parser.add_argument("--batch-size", help="max. number of rows written at once (default: 1000)", type=int,
+                        default=1000)
+    parser.add_argument("--max-pending", help="max. number of received batches per log file that wait for the disk "
+                                              "(default: 64)", type=int, default=64)
+    args = parser.parse_args()
+
+    if not args.tcp and not args.unix:
+        parser.error("at least one of --tcp and --unix is needed")
+
+    collector = LogCollector(args.directory, args.binary, args.batch_size, args.max_pending)
+    asyncio.run(serve(collector, args.tcp, args.unix))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+High-frequency capture of the mouse trajectory for the pointing (P operator) analysis.
+
+Qt can deliver hundreds of MouseMove events per second, so the samples are only stored in a preallocated ring buffer
+in the event filter (no allocation, no I/O) and downsampled to a configurable rate. The buffer is drained and written
+to the log in one batch between the clicks.
+"""
+
+import numpy as np
+
+
+# the timestamps are integer nanoseconds (see calculator_logger.SessionClock)
+TRAJECTORY_DTYPE = np.dtype([("timeStampNs", "<i8"), ("x", "<i4"), ("y", "<i4")])
+TRAJECTORY_COLUMNS = list(TRAJECTORY_DTYPE.names)
+
+
+class TrajectoryBuffer:
+    """
+    A ring buffer of (timeStampNs, x, y) samples. Samples that arrive faster than the sample rate are coalesced: the
+    newest sample of such a burst replaces the pending one, so the last position before a click (the end of the
+    pointing movement) is always kept. Samples that don't change the position are ignored. If the buffer isn't drained
+    in time, the oldest samples are overwritten (and counted in dropped_samples).
+    """
+
+    def __init__(self, capacity: int = 4096, sample_rate: float = 120.0):
+        """
+        :param capacity: the max. number of samples between two drains
+        :param sample_rate: the max. number of samples per second that are kept (None or 0 to keep every sample)
+        """
+        self.__samples = np.zeros(capacity, dtype=TRAJECTORY_DTYPE)
+        self.__capacity = capacity
+        self.__min_interval_ns = int(1e9 / sample_rate) if sample_rate else 0
+        self.__start = 0
+        self.__size = 0
+        # the newest sample of the current burst, it is only stored when the burst is over (or on flush())
+        self.__pending = None
+        self.__burst_start_ns = None
+        self.__last_position = None
+        self.dropped_samples = 0
+
+    def __len__(self):
+        return self.__size + (self.__pending is not None)
+
+    def add(self, time_stamp_ns: int, x: int, y: int) -> bool:
+        """
+        Adds a sample to the buffer.
+
+        :return: False if the sample was coalesced with the previous one (or didn't change the position)
+        """
+        if self.__last_position == (x, y):
+            return False
+        self.__last_position = (x, y)
+        if self.__pending is not None and time_stamp_ns - self.__burst_start_ns < self.__min_interval_ns:
+            self.__pending = (time_stamp_ns, x, y)
+            return False
+        self.flush()
+        self.__pending = (time_stamp_ns, x, y)
+        self.__burst_start_ns = time_stamp_ns
+        return True
+
+    def flush(self) -> None:
+        """
+        Stores the pending sample of the current burst, e.g. before a click so the last position is in the buffer.
+        """
+        if self.__pending is None:
+            return
+        index = (self.__start + self.__size) % self.__capacity
+        self.__samples[index] = self.__pending
+        self.__pending = None
+        if self.__size < self.__capacity:
+            self.__size += 1
+        else:
+            # the buffer is full, so the oldest sample is overwritten
+            self.__start = (self.__start + 1) % self.__capacity
+            self.dropped_samples += 1
+
+    def drain(self) -> np.ndarray:
+        """
+        Removes all samples from the buffer (including the pending one) and returns them in chronological order (as a
+        copy).
+        """
+        self.flush()
+        end = self.__start + self.__size
+        if end <= self.__capacity:
+            samples = self.__samples[self.__start:end].copy()
+        else:
+            samples = np.concatenate((self.__samples[self.__start:], self.__samples[:end - self.__capacity]))
+        self.__start = 0
+        self.__size = 0
+        return samples
@@ -0,0 +1,56 @@
+"""
+Compares the IncrementalEvaluator with the eval() call it replaced in the IttCalculator classes.
+"""
+
+import sys
+
+import pytest
+
+from calculator_evaluator import IncrementalEvaluator
+
+
+def evaluate(equation: str) -> str:
+    evaluator = IncrementalEvaluator()
+    evaluator.add(equation)
+    return evaluator.result()
+
+
+def evaluate_like_before(equation: str) -> str:
+    # the old __calculate_result() of the calculators
+    try:
+        return str(eval(equation))
+    except Exception:
+        return "Err"
+
+
+@pytest.mark.parametrize("equation", ["1+2*3", "(1+2)*3", "7/2", "-(3-5)*-2", "1/0", "1+", "(1+2", "1+2)", ".5*4",
+                                      "1..2", "", "00", "0", "00.5", "01.5", "01", "007+1", "1+02", "(01)", "1-0*3"])
+def test_same_result_as_eval(equation):
+    assert evaluate(equation) == evaluate_like_before(equation)
+
+
+@pytest.mark.skipif(not hasattr(sys, "get_int_max_str_digits"), reason="python has no int/str digit limit")
+def test_more_digits_than_python_converts():
+    limit = sys.get_int_max_str_digits()
+    long_number = "9" * (limit + 1)
+    assert evaluate(long_number) == "Err"
+    assert evaluate(long_number + "+1") == "Err"
+
+    # the numbers can be converted, but the result is too long for str()
+    factor = "9" * (limit // 2 + 1)
+    evaluator = IncrementalEvaluator()
+    evaluator.add(f"{factor}*{factor}")
+    assert evaluator.preview() is not None
+    assert evaluator.result() == "Err"
+
+
+def test_delete_restores_a_valid_number():
+    evaluator = IncrementalEvaluator()
+    evaluator.add("01")
+    assert evaluator.result() == "Err"
+    evaluator.add(".5")
+    assert evaluator.result() == "1.5"
+    evaluator.delete_last()
+    evaluator.delete_last()
+    evaluator.delete_last()
+    assert evaluator.result() == "0"
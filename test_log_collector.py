@@ -0,0 +1,188 @@
+"""
+Runs the log collector in a background event loop and streams rows to it with the NetworkLogWriter and with
+headless calculators.
+"""
+
+import csv
+import json
+import time
+import socket
+import asyncio
+import threading
+
+import pytest
+
+from calculator_logger import NetworkLogWriter
+from log_collector import LogCollector
+
+
+COLUMNS = ["timeStamp", "eventType", "isMouse", "klmId", "argument", "timeStampNs"]
+
+
+@pytest.fixture
+def collector_address(tmp_path):
+    """
+    Starts a collector that writes into tmp_path / "collected" and returns the address of its unix socket.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    collector = LogCollector(str(tmp_path / "collected"))
+    socket_path = str(tmp_path / "collector.sock")
+    server = asyncio.run_coroutine_threadsafe(collector.start_unix_server(socket_path), loop).result(5)
+    yield f"unix://{socket_path}"
+
+    async def stop():
+        server.close()
+        await collector.wait_until_idle()
+        await collector.close()
+
+    asyncio.run_coroutine_threadsafe(stop(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+
+
+def _rows(start, count):
+    return [[index / 1e3, "keyStroke", False, "K", str(index % 10), index] for index in range(start, start + count)]
+
+
+def _read_csv(file_name):
+    with open(file_name, newline="") as log_file:
+        return list(csv.reader(log_file))
+
+
+def _write_session(address, log_file_name, rows):
+    writer = NetworkLogWriter(address, log_file_name, COLUMNS, flush_interval=0.01)
+    writer.write_rows(rows)
+    assert writer.sync(5)
+    writer.close()
+    return writer
+
+
+def test_sessions_continue_an_existing_collected_log(tmp_path, collector_address):
+    local_log = str(tmp_path / "calculator_experiment_p_1.csv")
+    first = _write_session(collector_address, local_log, _rows(0, 5))
+    # the second session opens the file the first one created
+    second = _write_session(collector_address, local_log, _rows(5, 5))
+
+    collected = _read_csv(tmp_path / "collected" / "calculator_experiment_p_1.csv")
+    assert collected[0] == COLUMNS
+    assert [int(row[-1]) for row in collected[1:]] == list(range(10))
+    assert first.fallback_rows == second.fallback_rows == 0
+    assert not (tmp_path / "calculator_experiment_p_1.csv").exists()
+
+
+def test_legacy_collected_log_is_continued_without_the_new_columns(tmp_path, collector_address):
+    (tmp_path / "collected").mkdir(exist_ok=True)
+    collected_log = tmp_path / "collected" / "legacy.csv"
+    collected_log.write_text(",".join(COLUMNS[:5]) + "\n0.5,keyStroke,False,K,1\n")
+
+    _write_session(collector_address, str(tmp_path / "legacy.csv"), _rows(0, 3))
+
+    collected = _read_csv(collected_log)
+    assert collected[0] == COLUMNS[:5]
+    assert len(collected) == 5 and all(len(row) == 5 for row in collected)
+
+
+def test_rows_without_confirmation_go_to_the_local_file(tmp_path):
+    # a collector that reads everything but drops the connection instead of confirming the sync
+    socket_path = str(tmp_path / "broken.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+
+    def drop_on_sync():
+        connection, _ = server.accept()
+        with connection, connection.makefile("rb") as messages:
+            for message in messages:
+                if json.loads(message)["type"] == "sync":
+                    break
+
+    thread = threading.Thread(target=drop_on_sync, daemon=True)
+    thread.start()
+    local_log = str(tmp_path / "local.csv")
+    writer = NetworkLogWriter(f"unix://{socket_path}", local_log, COLUMNS, flush_interval=0.01)
+    writer.write_rows(_rows(0, 5))
+    assert not writer.sync(5)
+    writer.close()
+    thread.join(5)
+    server.close()
+
+    assert writer.fallback_rows == 5
+    local = _read_csv(local_log)
+    assert local[0] == COLUMNS
+    assert [int(row[-1]) for row in local[1:]] == list(range(5))
+
+
+@pytest.mark.parametrize("reads_messages", [True, False], ids=["no_answer", "no_reading"])
+def test_close_doesnt_wait_for_a_collector_that_stopped_answering(tmp_path, reads_messages):
+    # a collector that accepts the connection but never confirms the rows (or doesn't even read them anymore, like
+    # the collector's backpressure when the disk is behind)
+    socket_path = str(tmp_path / "stalled.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    stop = threading.Event()
+
+    def stall():
+        connection, _ = server.accept()
+        with connection:
+            while reads_messages and not stop.is_set() and connection.recv(65536):
+                pass
+            stop.wait(10)
+
+    thread = threading.Thread(target=stall, daemon=True)
+    thread.start()
+    local_log = str(tmp_path / "local.csv")
+    writer = NetworkLogWriter(f"unix://{socket_path}", local_log, COLUMNS, flush_interval=0.01, ack_timeout=0.2)
+    row_count = 50000  # more than fits into the socket buffers
+    for start in range(0, row_count, 1000):
+        writer.write_rows(_rows(start, 1000))
+    started = time.monotonic()
+    writer.close()
+    duration = time.monotonic() - started
+    stop.set()
+    thread.join(5)
+    server.close()
+
+    assert duration < 2
+    assert writer.fallback_rows == row_count
+    assert [int(row[-1]) for row in _read_csv(local_log)[1:]] == list(range(row_count))
+
+
+def test_headless_calculators_feed_the_collector(tmp_path, collector_address, monkeypatch):
+    monkeypatch.setenv("QT_QPA_PLATFORM", "offscreen")
+    QtWidgets = pytest.importorskip("PyQt5.QtWidgets")
+    QtCore = pytest.importorskip("PyQt5.QtCore")
+    QtTest = pytest.importorskip("PyQt5.QtTest")
+    import calculator
+    import calculator_experiment
+
+    # the experiment writes its log into the working directory
+    monkeypatch.chdir(tmp_path)
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    calculators = [calculator.IttCalculator(str(tmp_path / "calculatorLog.csv"), log_sink=collector_address),
+                   calculator_experiment.IttCalculator(1, log_sink=collector_address),
+                   calculator_experiment.IttCalculator(2, log_sink=collector_address)]
+    for number, window in enumerate(calculators):
+        for start_button in window.findChildren(QtWidgets.QPushButton, QtCore.QRegularExpression("_start$")):
+            if start_button.isVisibleTo(window):
+                start_button.click()
+        QtTest.QTest.keyClicks(window, f"{number}+(3*4)")
+        window.findChild(QtWidgets.QPushButton, "NumButton_7").click()
+        QtTest.QTest.keyClick(window, QtCore.Qt.Key_Backspace)
+        window.findChild(QtWidgets.QPushButton, "NumButton_Add").click()
+        QtTest.QTest.keyClick(window, QtCore.Qt.Key_Return)
+    app.processEvents()
+
+    for window, log_file_name in zip(calculators, ["calculatorLog.csv", "calculator_experiment_p_1.csv",
+                                                    "calculator_experiment_p_2.csv"]):
+        logged = window._calculatorLogger.get_log_data()
+        window.close()
+        expected = [list(logged.columns)] + [[str(value) for value in row] for row in logged.astype(object).where(
+            logged.notna(), "").itertuples(index=False, name=None)]
+        assert len(expected) > 8
+        assert _read_csv(tmp_path / "collected" / log_file_name) == expected
+        # nothing was written locally
+        assert not (tmp_path / log_file_name).exists()
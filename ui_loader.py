@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Loads the .ui files of the calculators from precompiled python modules instead of parsing the xml with uic.loadUi()
+on every start. The modules are generated into __uicache__ next to the .ui files and only regenerated when a .ui file
+is newer than its module, so this works as a build step (python ui_loader.py) and as a cache at runtime.
+"""
+
+import os
+import sys
+import time
+import importlib.util
+
+from PyQt5 import QtCore
+
+
+UI_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+UI_CACHE_DIRECTORY = os.path.join(UI_DIRECTORY, "__uicache__")
+
+
+def _compiled_module_path(ui_file: str) -> str:
+    module_name = os.path.splitext(os.path.basename(ui_file))[0] + "_ui"
+    return os.path.join(UI_CACHE_DIRECTORY, f"{module_name}.py")
+
+
+def compile_ui_file(ui_file: str, force: bool = False) -> str:
+    """
+    Compiles the given .ui file into a python module if the module doesn't exist yet or is older than the .ui file.
+
+    :return: the path of the compiled module
+    """
+    module_path = _compiled_module_path(ui_file)
+    if force or not os.path.isfile(module_path) or os.path.getmtime(module_path) < os.path.getmtime(ui_file):
+        # uic is only needed for compiling, so it isn't imported if the cache is up to date
+        from PyQt5 import uic
+
+        os.makedirs(UI_CACHE_DIRECTORY, exist_ok=True)
+        tmp_path = f"{module_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as module_file:
+            uic.compileUi(ui_file, module_file)
+        os.replace(tmp_path, module_path)
+    return module_path
+
+
+def load_ui(ui_file_name: str, widget):
+    """
+    Replacement for uic.loadUi(ui_file_name, widget): sets up the widget with the compiled version of the .ui file
+    and adds all child widgets as attributes of the widget. Relative file names are resolved against the directory of
+    this module instead of the current working directory.
+
+    :return: the widget
+    """
+    ui_file = ui_file_name if os.path.isabs(ui_file_name) else os.path.join(UI_DIRECTORY, ui_file_name)
+    try:
+        module_path = compile_ui_file(ui_file)
+    except OSError:
+        # e.g. if the directory isn't writable, so just parse the .ui file as before
+        from PyQt5 import uic
+        return uic.loadUi(ui_file, widget)
+
+    module_name = os.path.splitext(os.path.basename(module_path))[0]
+    module = sys.modules.get(module_name)
+    if module is None or getattr(module, "__file__", None) != module_path:
+        spec = importlib.util.spec_from_file_location(module_name, module_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[module_name] = module
+
+    # the generated module contains exactly one Ui_<top level widget> class
+    ui_class = next(value for name, value in vars(module).items() if name.startswith("Ui_"))
+    ui = ui_class()
+    ui.setupUi(widget)
+    for name, value in vars(ui).items():
+        setattr(widget, name, value)
+    return widget
+
+
+# the clock of the process start time in /proc (None if it isn't available)
+_STARTUP_CLOCK_ID = getattr(time, "CLOCK_BOOTTIME", None)
+
+
+def startup_clock() -> float:
+    """
+    Returns the current time in seconds on the clock of process_start_time(): CLOCK_BOOTTIME on linux, which is also
+    the clock of the process start time in /proc and keeps counting while the machine is suspended (unlike
+    time.perf_counter()), so the two can be compared even after a suspend.
+    """
+    return time.clock_gettime(_STARTUP_CLOCK_ID) if _STARTUP_CLOCK_ID is not None else time.perf_counter()
+
+
+# fallback for process_start_time() if /proc isn't available
+_MODULE_LOAD_TIME = startup_clock()
+
+
+def process_start_time() -> float:
+    """
+    Returns the start time of the current process on the startup_clock() (read from /proc on linux, so the
+    interpreter start and all imports are included). Falls back to the time this module was imported.
+    """
+    if _STARTUP_CLOCK_ID is None:
+        return _MODULE_LOAD_TIME
+    try:
+        with open("/proc/self/stat") as stat_file:
+            # the process start time is field 22 (in clock ticks after boot); the command name in field 2 may contain
+            # spaces, so the fields are counted from its closing parenthesis
+            start_ticks = int(stat_file.read().rsplit(")", 1)[1].split()[19])
+        return start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return _MODULE_LOAD_TIME
+
+
+class FirstFrameTimer(QtCore.QObject):
+    """
+    Measures the time from the given start time (on the startup_clock(), e.g. process_start_time()) until the first
+    paint event of the widget and prints it.
+    """
+
+    def __init__(self, widget, start_time: float):
+        super().__init__(widget)
+        self.__start_time = start_time
+        self.time_to_first_frame = None
+        widget.installEventFilter(self)
+
+    def eventFilter(self, source, event):
+        if event.type() == QtCore.QEvent.Paint and self.time_to_first_frame is None:
+            self.time_to_first_frame = startup_clock() - self.__start_time
+            source.removeEventFilter(self)
+            print(f"Time to first frame: {self.time_to_first_frame * 1000:.1f} ms")
+        return False
+
+
+def main():
+    # build step: compile all .ui files in this directory
+    for file_name in sorted(os.listdir(UI_DIRECTORY)):
+        if file_name.endswith(".ui"):
+            print(f"{file_name} -> {compile_ui_file(os.path.join(UI_DIRECTORY, file_name))}")
+
+
+if __name__ == '__main__':
+    main()